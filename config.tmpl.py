@@ -23,10 +23,64 @@ ISSUES = {
         "labels", "subtasks", "components", "watches", "votes", "resolutiondate",
     ],
 
-    # Shelve will append ".db"
+    # Keep only used parts of users, statuses and worklogs (True), or
+    # a custom {kind: [kept keys]} projection - see fatjira/projection.py
+    'payload_projection': True,
+
+    # Storage backend: 'sqlite' or a legacy 'shelve' (default when unset).
+    # Changing it requires a full resync.
+    'cache_backend': 'sqlite',
+    # Compress stored issues: None, 'zlib' or 'lzma'. zlib is primed with
+    # a dictionary built from the first synchronized issues.
+    'cache_compression': 'zlib',
+    'cache_compression_level': 6,
+    'cache_compression_dict': True,
+    # Keep all issues also in a single file rewritten after each sync, for
+    # a quick ServiceJira.all_cached_issues() - eg. in scripts or --shell.
+    # The search reads only the extracts and doesn't use it.
+    'cache_snapshot': False,
+    # Shelve will append ".db", SQLite ".sqlite"
     'cache_path': 'issue_cache',
 
     'sync_since': '1970-01-01T01:00:00.000+0000',
+    # True reads worklogs of each updated issue; 'bulk' reads only worklogs
+    # changed since the last sync - much faster for worklog-heavy projects.
+    # Issues new to the cache created before sync_since are read one by one.
     'sync_worklogs': True,
+    # Issues committed to the cache at once, along with the sync progress.
+    'commit_interval': 250,
+    # Read next search page and store the previous one while reading worklogs.
+    'sync_pipeline': True,
+    # Split the initial sync into shards synchronized in parallel, eg.:
+    # ['project = A', 'project = B'] or
+    # ['updated < "2019-01-01"', 'updated >= "2019-01-01"']
+    'sync_shards': [],
+    'sync_shard_threads': 4,
     'threads': 4,
+
+    # Searchable text and field tokens extracted from issues; None uses
+    # DEFAULT_SPEC from fatjira/extract.py. Changing it recomputes extracts,
+    # using that many processes.
+    'extract_spec': None,
+    'extract_processes': 1,
+
+    # Memory budget in MB for very large caches: bounds the recently
+    # displayed issues (1/8) and the search term cache (1/4). None keeps
+    # the defaults.
+    # Breakdown of the usage is logged in the debug window (M-m in search).
+    'memory_budget': None,
+}
+
+SEARCH = {
+    # Index narrowing the search: None or 'trigram' (faster search on large
+    # caches at the cost of memory and start-up time).
+    'engine': None,
+    # Split the search across that many processes to use multiple cores.
+    'processes': 1,
+    # Order results by the match location (key, summary, description),
+    # recency and being assigned to you. Not used with multiple processes.
+    'ranking': False,
+    # Load the search in background at start-up, instead of on the first
+    # use. It's then shared by all search views.
+    'preload': True,
 }
@@ -1,9 +1,9 @@
 import logging
 log = logging.getLogger('fatjira')
 
+from .incremental_search import IncrementalSearch
 from .issue_cache import IssueCache
 from .service_jira import ServiceJira
-from .incremental_search import IncrementalSearch
 
 from . import views
 from .theme import FatjiraTheme
@@ -0,0 +1,209 @@
+"""
+Sorted column indexes answering the range filters, eg. "upd>2026-09-01",
+"created<7d", "spent>4h" or "due<today".
+"""
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from time import time
+
+from fatjira.extract import extract_columns
+
+# Query names of the columns and the kinds of their values.
+COLUMNS = {
+    'upd': 'time',
+    'created': 'time',
+    'resolved': 'time',
+    'due': 'time',
+    'spent': 'duration',
+}
+
+# Seconds of the duration units - Jira defaults of 8h days and 5d weeks.
+UNITS = {
+    'w': 5 * 8 * 3600,
+    'd': 8 * 3600,
+    'h': 3600,
+    'm': 60,
+}
+
+# Calendar length of the units used for relative times.
+AGE_UNITS = {
+    'w': 7 * 24 * 3600,
+    'd': 24 * 3600,
+    'h': 3600,
+    'm': 60,
+}
+
+OPERATORS = (">=", "<=", ">", "<")
+
+# Operator for the age compared instead of the time, eg. "upd<7d".
+INVERTED = {">": "<", "<": ">", ">=": "<=", "<=": ">="}
+
+TERM_RE = re.compile(r"^(%s)(%s)(.*)$" % (
+    "|".join(COLUMNS), "|".join(re.escape(operator) for operator in OPERATORS)
+))
+DURATION_RE = re.compile(r"^(?:(\d+(?:\.\d+)?)([wdhm]))+$")
+DURATION_PART_RE = re.compile(r"(\d+(?:\.\d+)?)([wdhm])")
+
+
+def parse_duration(value, units=UNITS):
+    "Jira-like duration, eg. 1h30m, into seconds; None if not valid"
+    if not DURATION_RE.match(value):
+        return None
+    return sum(float(number) * units[unit]
+               for number, unit in DURATION_PART_RE.findall(value))
+
+
+class ColumnIndex:
+    """
+    Numeric columns of document values sorted for the range filters.
+
+    Filter selects a contiguous range of a column found by a binary search,
+    so it costs O(log N + result) instead of a scan. Documents without a
+    value never match.
+
+    Time values are dates (2026-09-01), "today", "yesterday", "now" or
+    relative ages: "upd<7d" selects issues updated within the last 7 days.
+    Spent time is a duration - 4h, 1d, 1w2d; a plain number is in hours.
+
+    Args:
+      extracts: list of searched texts
+      now: function returning the current timestamp
+    """
+
+    def __init__(self, extracts, now=time):
+        self.now = now
+        # {column: (values, indices)} sorted by values
+        self.columns = {column: (array('d'), array('I')) for column in COLUMNS}
+        # Columns appended to since being sorted
+        self._unsorted = set()
+        self.size = 0
+        self.extend(0, extracts)
+
+    def extend(self, first, extracts):
+        "Add extracts of documents appended at the `first` index"
+        for idx, extract in enumerate(extracts, first):
+            for column, value in self._values(extract):
+                values, indices = self.columns[column]
+                values.append(value)
+                indices.append(idx)
+                self._unsorted.add(column)
+            self.size = max(self.size, idx + 1)
+
+    @staticmethod
+    def _values(extract):
+        "Yield (column, value) of an extract"
+        for token in extract_columns(extract):
+            column, sep, value = token.partition("=")
+            if sep and column in COLUMNS:
+                try:
+                    yield column, float(value)
+                except ValueError:
+                    continue
+
+    def _sorted(self, column):
+        if column in self._unsorted:
+            values, indices = self.columns[column]
+            order = sorted(range(len(values)), key=values.__getitem__)
+            self.columns[column] = (array('d', (values[i] for i in order)),
+                                    array('I', (indices[i] for i in order)))
+            self._unsorted.discard(column)
+        return self.columns[column]
+
+    def parse_term(self, term):
+        """
+        Parse a range filter.
+
+        Returns:
+          (column, operator, bound) - bound is None for a value being typed,
+          or None if the term is not a range filter.
+        """
+        match = TERM_RE.match(term)
+        if match is None:
+            return None
+        column, operator, value = match.groups()
+        value = value.lower()
+        if COLUMNS[column] == 'duration':
+            try:
+                bound = float(value) * 3600
+            except ValueError:
+                bound = parse_duration(value)
+            return column, operator, bound
+
+        age = parse_duration(value, AGE_UNITS)
+        if age is not None:
+            return column, INVERTED[operator], self.now() - age
+        return column, operator, self._parse_time(value)
+
+    def _parse_time(self, value):
+        today = datetime.fromtimestamp(self.now()).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        if value == "now":
+            return self.now()
+        if value == "today":
+            return today.timestamp()
+        if value == "yesterday":
+            return (today - timedelta(days=1)).timestamp()
+        try:
+            return datetime.strptime(value, "%Y-%m-%d").timestamp()
+        except ValueError:
+            return None
+
+    def indexed_values(self):
+        "Ranges are resolved alike in each shard, nothing to share"
+        return None
+
+    def share_values(self, shard_values):
+        pass
+
+    def is_complete(self, column, operator, bound):
+        "Changing the value of a range doesn't narrow it"
+        return True
+
+    def is_volatile(self, column, operator, bound):
+        "Results may depend on the current time"
+        return COLUMNS[column] == 'time'
+
+    def lookup(self, column, operator, bound):
+        """
+        Find documents within the range.
+
+        Returns:
+          ordered array of indices; all documents while the value is invalid
+        """
+        if bound is None:
+            return array('I', range(self.size))
+        values, indices = self._sorted(column)
+        if operator == ">":
+            selected = indices[bisect_right(values, bound):]
+        elif operator == ">=":
+            selected = indices[bisect_left(values, bound):]
+        elif operator == "<":
+            selected = indices[:bisect_left(values, bound)]
+        else:
+            selected = indices[:bisect_right(values, bound)]
+        return array('I', sorted(selected))
+
+    def matches(self, extract, column, operator, bound):
+        "Does a single extract match the range"
+        if bound is None:
+            return True
+        for value_column, value in self._values(extract):
+            if value_column != column:
+                continue
+            if operator == ">":
+                return value > bound
+            if operator == ">=":
+                return value >= bound
+            if operator == "<":
+                return value < bound
+            return value <= bound
+        return False
+
+    def memory_usage(self):
+        "Size of the columns in bytes"
+        return sum(
+            values.itemsize * len(values) + indices.itemsize * len(indices)
+            for values, indices in self.columns.values()
+        )
@@ -0,0 +1,243 @@
+"""
+Extraction of searchable text from issues.
+
+Extracts are computed when the issues are stored and persisted along them,
+so that the search can start without decoding the issues.
+
+Extract is a free text - key, summary and description - followed by the
+field tokens, eg. "st=OPEN", which are indexed for the exact field filters.
+Tokens are separated by FIELD_SEP, so the values can contain spaces.
+Numeric column tokens, eg. "upd=1601546400", come last; they are indexed
+for the range filters, but not searched as a text.
+"""
+import hashlib
+import json
+from datetime import datetime
+from itertools import repeat
+from time import time
+from concurrent.futures import ProcessPoolExecutor
+
+from fatjira import log
+
+# Bump when the extract format changes, to recompute the persisted extracts.
+EXTRACT_VERSION = 5
+
+# Separates the summary from the description.
+DESCRIPTION_START = "\x1d"
+# Separates the free text from the field tokens.
+FIELDS_START = "\x1e"
+# Separates the field tokens.
+FIELD_SEP = "\x1f"
+# Separates the column tokens - not searched as a text.
+COLUMNS_START = "\x1c"
+
+# Query prefixes of the field filters and the fields they select.
+FIELD_PREFIXES = {
+    'k=': 'key',
+    '@': 'assignee',
+    'rep=': 'reporter',
+    'st=': 'status',
+    't=': 'issuetype',
+    'p=': 'project',
+    'l=': 'labels',
+    'c=': 'components',
+}
+
+
+# Declarative extraction: free text parts followed by the field and the
+# column tokens.
+# Paths are dotted keys, "[]" iterates over a list. Missing values produce
+# an empty text or no token, unless a default is given.
+DEFAULT_SPEC = {
+    'text': [
+        {'path': 'key'},
+        {'path': 'fields.summary'},
+        {'path': 'fields.description', 'prefix': DESCRIPTION_START},
+    ],
+    'fields': [
+        {'path': 'key', 'prefix': 'k='},
+        {'path': 'fields.assignee.name', 'prefix': '@', 'default': 'none'},
+        {'path': 'fields.reporter.name', 'prefix': 'rep=', 'default': 'none'},
+        {'path': 'fields.status.name', 'prefix': 'st=', 'transform': 'squash'},
+        {'path': 'fields.issuetype.name', 'prefix': 't='},
+        {'path': 'fields.project.key', 'prefix': 'p='},
+        {'path': 'fields.labels[]', 'prefix': 'l='},
+        {'path': 'fields.components[].name', 'prefix': 'c='},
+    ],
+    # Numeric tokens of the range filters and ranking.
+    'columns': [
+        {'path': 'fields.updated', 'prefix': 'upd=', 'transform': 'timestamp'},
+        {'path': 'fields.created', 'prefix': 'created=', 'transform': 'timestamp'},
+        {'path': 'fields.resolutiondate', 'prefix': 'resolved=', 'transform': 'timestamp'},
+        {'path': 'fields.duedate', 'prefix': 'due=', 'transform': 'date'},
+        {'path': 'fields.timespent', 'prefix': 'spent='},
+    ],
+}
+
+
+def _timestamp(value):
+    "Jira time into an integer timestamp"
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        parsed = datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.000%z')
+    return "%d" % parsed.timestamp()
+
+
+def _date(value):
+    "Jira date into a timestamp of its local midnight"
+    return "%d" % datetime.strptime(value, '%Y-%m-%d').timestamp()
+
+
+TRANSFORMS = {
+    'squash': lambda value: value.upper().replace(" ", ""),
+    'timestamp': _timestamp,
+    'date': _date,
+}
+
+
+def _get_many(obj, keys):
+    "Values found on a path iterating over lists of the keys ending with []"
+    values = [obj]
+    for key in keys:
+        many = key.endswith("[]")
+        if many:
+            key = key[:-2]
+        found = []
+        for value in values:
+            value = value.get(key) if isinstance(value, dict) else None
+            if value is None:
+                continue
+            if many:
+                found.extend(value)
+            else:
+                found.append(value)
+        values = found
+    return values
+
+
+def _compile_entry(lines, i, entry, field):
+    "Append source lines extracting a single spec entry"
+    keys = entry['path'].split(".")
+    transform = entry.get('transform')
+    if transform is not None and transform not in TRANSFORMS:
+        raise Exception(f"Unknown extract transform {transform}")
+    if transform is not None:
+        convert = f"T{i}(%s)"
+    else:
+        convert = "(%s if %s.__class__ is str else str(%s))"
+
+    def conv(name):
+        return convert.replace("%s", name)
+
+    default = entry.get('default')
+    if any(key.endswith("[]") for key in keys):
+        lines.append(f"    values = _get_many(issue, {keys!r})")
+        converted = f"[{conv('value')} for value in values]"
+    else:
+        lookup = "".join(f"[{key!r}]" for key in keys)
+        lines += [
+            "    try:",
+            f"        value = issue{lookup}",
+            "    except (KeyError, TypeError, IndexError):",
+            "        value = None",
+            "    values = () if value is None else (value,)",
+        ]
+        converted = f"[{conv('value')}]"
+
+    lines.append("    if values:")
+    if field:
+        lines.append(f"        tokens.extend([P{i} + token for token in {converted}])")
+        if default is not None:
+            lines += ["    else:", f"        tokens.append(P{i} + D{i})"]
+    else:
+        lines.append(f"        text.append(P{i} + ' '.join({converted}))")
+        lines += ["    else:", f"        text.append(P{i} + D{i})"]
+    return {
+        f"P{i}": entry.get('prefix', ""),
+        f"D{i}": default if default is not None or field else "",
+        f"T{i}": TRANSFORMS.get(transform),
+    }
+
+
+def compile_spec(spec):
+    """
+    Compile an extraction spec (see DEFAULT_SPEC) into a flat extractor
+    function - without walking the spec for each issue.
+    """
+    lines = ["def extract(issue):", "    text = []", "    tokens = []"]
+    namespace = {'_get_many': _get_many}
+    entries = [(entry, False) for entry in spec.get('text', [])]
+    entries += [(entry, True) for entry in spec.get('fields', [])]
+    for i, (entry, field) in enumerate(entries):
+        namespace.update(_compile_entry(lines, i, entry, field))
+    lines.append(
+        f"    extract = ' '.join(text) + ' ' + {FIELDS_START!r} + {FIELD_SEP!r}.join(tokens)"
+    )
+    if spec.get('columns'):
+        lines.append("    tokens = []")
+        offset = len(entries)
+        for i, entry in enumerate(spec['columns'], offset):
+            namespace.update(_compile_entry(lines, i, entry, True))
+        lines.append(f"    extract += {COLUMNS_START!r} + {FIELD_SEP!r}.join(tokens)")
+    lines.append("    return extract")
+    exec("\n".join(lines), namespace)
+    return namespace['extract']
+
+
+def spec_version(spec):
+    "Version of extracts created by the spec"
+    if spec is None or spec == DEFAULT_SPEC:
+        return EXTRACT_VERSION
+    digest = hashlib.sha1(json.dumps(spec, sort_keys=True).encode('utf-8'))
+    return "%d:%s" % (EXTRACT_VERSION, digest.hexdigest()[:12])
+
+
+extract_issue = compile_spec(DEFAULT_SPEC)
+
+
+def _extract_chunk(spec, issues):
+    return list(map(compile_spec(spec), issues))
+
+
+def build_extracts(issues, spec=None, processes=1, chunk_size=2000):
+    """
+    Extract a list of issues, optionally in chunks on a process pool.
+
+    Issues are pickled to the workers, so it pays off only for large lists
+    and specs with costly transforms.
+    """
+    spec = spec or DEFAULT_SPEC
+    start = time()
+    if processes <= 1 or len(issues) <= chunk_size:
+        extracts = _extract_chunk(spec, issues)
+    else:
+        chunks = [issues[i:i + chunk_size] for i in range(0, len(issues), chunk_size)]
+        extracts = []
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            for part in pool.map(_extract_chunk, repeat(spec), chunks):
+                extracts.extend(part)
+        processes = min(processes, len(chunks))
+    took = time() - start
+    log.info("Extracted %d issues in %.2fs using %d processes (%.0f issues/s)",
+             len(issues), took, max(1, processes), len(issues) / (took or 1e-9))
+    return extracts
+
+
+def extract_fields(extract):
+    "List field tokens of an extract"
+    pos = extract.rfind(FIELDS_START)
+    if pos == -1:
+        return []
+    end = extract.find(COLUMNS_START, pos)
+    if end == -1:
+        end = len(extract)
+    return extract[pos + 1:end].split(FIELD_SEP)
+
+
+def extract_columns(extract):
+    "List column tokens of an extract"
+    pos = extract.rfind(COLUMNS_START)
+    if pos == -1:
+        return []
+    return extract[pos + 1:].split(FIELD_SEP)
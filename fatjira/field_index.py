@@ -0,0 +1,183 @@
+"""
+Exact-match indexes of issue fields answering the structured query filters.
+"""
+from array import array
+from bisect import bisect_left
+
+from fatjira.extract import FIELD_PREFIXES, extract_fields
+
+
+class FieldIndex:
+    """
+    Hash index of field values per query prefix, built from the field tokens
+    of extracts.
+
+    Filter "st=OPEN" selects issues with exactly the OPEN status and costs
+    O(result) instead of a scan. Value not present in the index is treated
+    as an incomplete one and selects all values starting with it, so the
+    results stay useful while the filter is being typed. Values are
+    matched case-insensitively.
+
+    Args:
+      extracts: list of searched texts
+      prefixes: recognized query prefixes
+    """
+
+    def __init__(self, extracts, prefixes=FIELD_PREFIXES):
+        # Longest first, so that a prefix of another prefix is tried last.
+        self.prefixes = sorted(prefixes, key=len, reverse=True)
+        # {prefix: {value: array of indices}}
+        self.postings = {prefix: {} for prefix in self.prefixes}
+        # Sorted values for the incomplete filters, created lazily.
+        self._sorted = {}
+        # Values indexed only by other shards of a partitioned search
+        self.shared = {prefix: set() for prefix in self.prefixes}
+        self.extend(0, extracts)
+
+    def extend(self, first, extracts):
+        "Index extracts of documents appended at the `first` index"
+        for idx, extract in enumerate(extracts, first):
+            for prefix, value in self.parse_tokens(extract_fields(extract)):
+                postings = self.postings[prefix]
+                try:
+                    posting = postings[value]
+                except KeyError:
+                    posting = postings[value] = array('I')
+                    self._sorted.pop(prefix, None)
+                if not posting or posting[-1] != idx:
+                    posting.append(idx)
+
+    def parse_term(self, term):
+        """
+        Split a query term into a prefix and a lowercase value.
+
+        Returns:
+          (prefix, value) or None if the term is not a field filter.
+        """
+        for prefix in self.prefixes:
+            if term.startswith(prefix) and len(term) > len(prefix):
+                return prefix, term[len(prefix):].lower()
+        return None
+
+    def parse_tokens(self, tokens):
+        "Yield (prefix, value) of the field tokens"
+        for token in tokens:
+            parsed = self.parse_term(token)
+            if parsed is not None:
+                yield parsed
+
+    def indexed_values(self):
+        "Values of each prefix - to be shared with the other shards"
+        return {prefix: set(postings) for prefix, postings in self.postings.items()}
+
+    def share_values(self, shard_values):
+        """
+        Treat values indexed by any shard of a partitioned search as complete,
+        so all shards decide between an exact and a prefix filter alike.
+
+        Args:
+          shard_values: indexed_values() of all shards
+        """
+        for values in shard_values:
+            for prefix, shared in values.items():
+                self.shared[prefix].update(shared.difference(self.postings[prefix]))
+
+    def is_complete(self, prefix, value):
+        "Filter selects an exact value"
+        return value in self.postings[prefix] or value in self.shared[prefix]
+
+    def is_volatile(self, prefix, value):
+        "Results don't change with time"
+        return False
+
+    def lookup(self, prefix, value):
+        """
+        Find documents matching a field filter.
+
+        Returns:
+          ordered array of indices
+        """
+        postings = self.postings[prefix]
+        found = postings.get(value)
+        if found is not None:
+            return found
+        if value in self.shared[prefix]:
+            return array('I')
+
+        values = self._sorted.get(prefix)
+        if values is None:
+            values = self._sorted[prefix] = sorted(postings)
+        pos = bisect_left(values, value)
+        merged = set()
+        while pos < len(values) and values[pos].startswith(value):
+            merged.update(postings[values[pos]])
+            pos += 1
+        return array('I', sorted(merged))
+
+    def matches(self, extract, prefix, value):
+        "Does a single extract match the field filter"
+        values = [
+            token_value
+            for token_prefix, token_value in self.parse_tokens(extract_fields(extract))
+            if token_prefix == prefix
+        ]
+        if self.is_complete(prefix, value):
+            return value in values
+        return any(token_value.startswith(value) for token_value in values)
+
+    def memory_usage(self):
+        "Approximate size of the posting lists in bytes"
+        return sum(
+            posting.itemsize * len(posting)
+            for postings in self.postings.values()
+            for posting in postings.values()
+        )
+
+
+class CombinedIndex:
+    """
+    Several filter indexes - eg. FieldIndex and ColumnIndex - behind the
+    interface of a single one. Terms are parsed by the first index
+    recognizing them.
+
+    Args:
+      extracts: list of searched texts
+      indexes: index factories called with the extracts
+    """
+
+    def __init__(self, extracts, indexes):
+        self.indexes = [index(extracts) for index in indexes]
+
+    def extend(self, first, extracts):
+        for index in self.indexes:
+            index.extend(first, extracts)
+
+    def parse_term(self, term):
+        "Returns: (index, parsed term) or None"
+        for index in self.indexes:
+            parsed = index.parse_term(term)
+            if parsed is not None:
+                return index, parsed
+        return None
+
+    def indexed_values(self):
+        return [index.indexed_values() for index in self.indexes]
+
+    def share_values(self, shard_values):
+        for position, index in enumerate(self.indexes):
+            index.share_values([values[position] for values in shard_values])
+
+    def is_complete(self, index, parsed):
+        return index.is_complete(*parsed)
+
+    def is_volatile(self, index, parsed):
+        return index.is_volatile(*parsed)
+
+    def lookup(self, index, parsed):
+        return index.lookup(*parsed)
+
+    def matches(self, extract, index, parsed):
+        return index.matches(extract, *parsed)
+
+    def memory_usage(self):
+        return sum(index.memory_usage() for index in self.indexes)
@@ -1,21 +1,261 @@
-# TODO: Threading / Parallel without blocking the UI
+import re
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+
+class Corpus:
+    """
+    Columnar store of extracts: all of them concatenated into a single
+    original-case and a single pre-lowered buffer, with offsets of documents.
+
+    Finding a term in all documents is a few `str.find` sweeps over the
+    buffer, without allocating a lowered copy of each extract per search.
+    Acts as a read-only sequence of extracts.
+
+    Tail of an extract starting with TAIL_START is kept in a separate
+    buffer and never searched.
+    """
+
+    # Separator never present in a search term.
+    SEP = "\x00"
+
+    # Fuzzy terms match within the head of an extract - up to the first of
+    # these separators, eg. the key and summary of an issue.
+    HEAD_END = "\x1d\x1e"
+
+    # Start of the unsearched tail, eg. numeric columns of an issue.
+    TAIL_START = "\x1c"
+
+    def __init__(self, extracts):
+        searched, tails = self._split(extracts)
+        self.text, self.offsets = self._concat(searched)
+        self.lower, self.lower_offsets = self._concat(
+            text.lower() for text in searched
+        )
+        self.tails, self.tail_offsets = self._concat(tails)
+        # {sensitive: (buffer, offsets)} of document heads for fuzzy search
+        self.heads = None
+
+    def _split(self, extracts):
+        "Split extracts into the searched parts and the tails"
+        searched, tails = [], []
+        for extract in extracts:
+            pos = extract.find(self.TAIL_START)
+            if pos == -1:
+                searched.append(extract)
+                tails.append("")
+            else:
+                searched.append(extract[:pos])
+                tails.append(extract[pos:])
+        return searched, tails
+
+    def _concat(self, texts, position=0):
+        "Join texts; offsets hold start of each text and the end of the last one"
+        offsets = array('Q', [position])
+        parts = []
+        for text in texts:
+            parts.append(text)
+            position += len(text) + 1
+            offsets.append(position)
+        if not parts:
+            return "", offsets
+        return self.SEP.join(parts) + self.SEP, offsets
+
+    def extend(self, extracts):
+        "Append extracts of new documents"
+        searched, tails = self._split(extracts)
+        text, offsets = self._concat(searched, self.offsets[-1])
+        self.text += text
+        self.offsets.extend(offsets[1:])
+        lower, offsets = self._concat((text.lower() for text in searched),
+                                      self.lower_offsets[-1])
+        self.lower += lower
+        self.lower_offsets.extend(offsets[1:])
+        tails, offsets = self._concat(tails, self.tail_offsets[-1])
+        self.tails += tails
+        self.tail_offsets.extend(offsets[1:])
+        # Heads are created again when needed
+        self.heads = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return (self.text[self.offsets[idx]:self.offsets[idx + 1] - 1] +
+                self.tails[self.tail_offsets[idx]:self.tail_offsets[idx + 1] - 1])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def _buffer(self, sensitive):
+        if sensitive:
+            return self.text, self.offsets
+        return self.lower, self.lower_offsets
+
+    def contains(self, idx, term, sensitive):
+        "Does a single document contain the term"
+        buf, offsets = self._buffer(sensitive)
+        return buf.find(term, offsets[idx], offsets[idx + 1]) != -1
+
+    @classmethod
+    def fuzzy_pattern(cls, term):
+        """
+        Regular expression matching the term characters as a subsequence.
+
+        Gap before each character excludes the character itself, so the
+        match is found without backtracking.
+        """
+        parts = [re.escape(term[0])]
+        for char in term[1:]:
+            parts.append("[^%s%s]*%s" % (re.escape(char), cls.SEP, re.escape(char)))
+        return re.compile("".join(parts))
+
+    def _heads(self, sensitive):
+        """
+        Buffer and offsets of the concatenated document heads, created on
+        the first fuzzy search.
+        """
+        if self.heads is None:
+            self.heads = {}
+        if sensitive not in self.heads:
+            buf, offsets = self._buffer(sensitive)
+            self.heads[sensitive] = self._concat(
+                buf[offsets[idx]:self._head_end(buf, offsets[idx], offsets[idx + 1] - 1)]
+                for idx in range(len(self))
+            )
+        return self.heads[sensitive]
+
+    def _head_end(self, buf, start, end):
+        "End of the document head"
+        for separator in self.HEAD_END:
+            pos = buf.find(separator, start, end)
+            if pos != -1:
+                end = pos
+        return end
+
+    def contains_fuzzy(self, idx, pattern, sensitive):
+        "Does a head of a single document contain the pattern"
+        buf, offsets = self._heads(sensitive)
+        return pattern.search(buf, offsets[idx], offsets[idx + 1]) is not None
+
+    def find_all_fuzzy(self, pattern, sensitive, cancel=None, on_partial=None,
+                       partial_size=100, check=2048):
+        "Sweep heads of all documents for a fuzzy pattern, see find_all"
+        buf, offsets = self._heads(sensitive)
+        found = array('I')
+        match = pattern.search(buf)
+        while match is not None:
+            idx = bisect_right(offsets, match.start()) - 1
+            found.append(idx)
+            if on_partial is not None and len(found) == partial_size:
+                on_partial(list(found))
+            if cancel is not None and len(found) % check == 0 and cancel():
+                return None
+            match = pattern.search(buf, offsets[idx + 1])
+        return found
+
+    def head(self, idx):
+        "Original text of a document head"
+        start, end = self.offsets[idx], self.offsets[idx + 1] - 1
+        return self.text[start:self._head_end(self.text, start, end)]
+
+    def find(self, idx, term, sensitive):
+        "Position of the term within a single document or -1"
+        buf, offsets = self._buffer(sensitive)
+        pos = buf.find(term, offsets[idx], offsets[idx + 1])
+        if pos == -1:
+            return -1
+        return pos - offsets[idx]
+
+    def find_all(self, term, sensitive, cancel=None, on_partial=None,
+                 partial_size=100, check=2048):
+        """
+        Sweep all documents for the term.
+
+        Returns:
+          array of matching document indices or None if cancelled
+        """
+        buf, offsets = self._buffer(sensitive)
+        found = array('I')
+        find = buf.find
+        pos = find(term)
+        while pos != -1:
+            idx = bisect_right(offsets, pos) - 1
+            found.append(idx)
+            if on_partial is not None and len(found) == partial_size:
+                on_partial(list(found))
+            if cancel is not None and len(found) % check == 0 and cancel():
+                return None
+            # Continue from the next document
+            pos = find(term, offsets[idx + 1])
+        return found
+
+    def memory_usage(self):
+        "Size of the buffers and offsets in bytes"
+        return (sys.getsizeof(self.text) + sys.getsizeof(self.lower) +
+                sys.getsizeof(self.tails) + sys.getsizeof(self.offsets) +
+                sys.getsizeof(self.lower_offsets) + sys.getsizeof(self.tail_offsets))
+
 
 class IncrementalSearch:
     """
     Universal incremental search within a list of documents.
     """
 
-    def __init__(self, documents, extract_fn):
+    def __init__(self, documents, extract_fn=None, extracts=None, engine=None,
+                 term_cache_memory=32 * 2**20, fields=None, ranker=None):
+        """
+        Args:
+          documents: list of searched documents (or their keys)
+          extract_fn: function creating a searchable text of a document
+          extracts: already extracted texts, instead of extract_fn
+          engine: optional index engine factory called with the extracts,
+            eg. TrigramIndex. Narrows candidates before the substring check.
+          term_cache_memory: memory budget of the term cache in bytes
+          fields: optional field index factory called with the extracts,
+            eg. FieldIndex, or CombinedIndex adding the ColumnIndex range
+            filters. Answers filter terms without a scan.
+          ranker: optional ranker factory called with the extracts, eg.
+            Ranker. Results are then returned best first.
+        """
         self.query = ""
         self.documents = documents
-        # Extracted texts related to the documents by index
-        self.extracts = []
-        # { "query": [result_idx1, ...], "query a": [result_idx2, ...], ...}
+        # Ordered result indices are kept in compact arrays.
+        # { "query": array([result_idx1, ...]), "query a": array([result_idx2, ...]), ...}
         self.cache = {}
-        self.current_results = list(range(len(documents)))
-        for doc in self.documents:
-            extract = extract_fn(doc)
-            self.extracts.append(extract)
+        # Results of single terms over all documents, in LRU order.
+        # { "term": array([result_idx1, ...]), ...}
+        self.term_cache = OrderedDict()
+        self.term_cache_size = 0
+        self.term_cache_memory = term_cache_memory
+        # Settled queries - not extended by the following query - with
+        # the number of times they were used and their results (or None).
+        # { "query": [count, array([result_idx1, ...])], ...}
+        self.history = {}
+        # Last completed (query, results)
+        self.settled = None
+        # Indices of removed documents, kept until the compaction.
+        self.removed = set()
+        # {document: index}, created on the first update
+        self.positions = None
+        self.current_results = self._all()
+        # Extracted texts related to the documents by index
+        if extracts is not None:
+            assert len(extracts) == len(documents)
+        else:
+            extracts = [extract_fn(doc) for doc in self.documents]
+        self.engine_factory = engine
+        self.engine = engine(extracts) if engine is not None else None
+        self.fields_factory = fields
+        self.fields = fields(extracts) if fields is not None else None
+        self.ranker_factory = ranker
+        self.ranker = ranker(extracts) if ranker is not None else None
+        # Lazily ranked current results
+        self.ranked = None
+        self.extracts = Corpus(extracts)
 
     def get_normalized_query(self):
         """
@@ -25,7 +265,14 @@ class IncrementalSearch:
         final_terms = []
         for term in input_terms:
             # Is the current term a prefix of other already present term?
-            dups = [t for t in final_terms if t.startswith(term)]
+            # Field filters are exact and negative or alternative terms don't
+            # imply their prefixes, so only their repetition is dropped.
+            negative, alternatives = self._parse_term(term)
+            if negative or len(alternatives) != 1 or self._field(term) is not None:
+                dups = term in final_terms
+            else:
+                dups = [t for t in final_terms
+                        if t.startswith(term) and self._parse_term(t) == (False, [t])]
             if dups:
                 # Drop term.
                 continue
@@ -33,10 +280,25 @@ class IncrementalSearch:
         return " ".join(final_terms)
 
     def get_results(self, max_results=2**32):
-        return [
-            self.documents[idx]
-            for idx in self.current_results[:max_results]
-        ]
+        if self.ranker is not None:
+            indices = self._ranked().top(max_results)
+        else:
+            indices = self.current_results[:max_results]
+        return [self.documents[idx] for idx in indices]
+
+    def _ranked(self):
+        "Ranked current results, reused until the results change"
+        query = self.get_normalized_query()
+        if (self.ranked is None or self.ranked.indices is not self.current_results
+                or self.ranked.query != query):
+            terms = [
+                term for term in query.split()
+                if self._parse_term(term) == (False, [term]) and
+                self._field(term) is None and not term.startswith("~")
+            ]
+            self.ranked = self.ranker.rank(self.current_results, terms, self.extracts)
+            self.ranked.query = query
+        return self.ranked
 
     def _invalidate_cache(self, query):
         "Remove cached results not matching the current query"
@@ -51,18 +313,98 @@ class IncrementalSearch:
         # Find best matching base results
         for cut in range(len(query), 0, -1):
             part = query[:cut]
-            if part in self.cache:
-                return self.cache[part], part
-        return list(range(len(self.documents))), ""
+            if part not in self.cache:
+                continue
+            if cut < len(query) and query[cut] != " " and part[-1] != " ":
+                term = part.split()[-1]
+                extended = query[cut - len(term):].split()[0]
+                if not self._narrows(term, extended):
+                    continue
+            return self.cache[part], part
+        return self._all(), ""
+
+    def _narrows(self, term, extended):
+        """
+        Are the results of an extended term a subset of the term results.
+
+        Holds for the free text terms, but not eg. for a negative term ("-b"
+        excludes less than "-be"), a new alternative ("a" and "a|b") or an
+        exact field filter ("st=OPEN" and "st=OPENED").
+        """
+        negative, alternatives = self._parse_term(term)
+        if not alternatives:
+            # Ignored, incomplete term
+            return True
+        if negative or "|" in extended[len(term):]:
+            return False
+        if "|" in term and term.split("|")[-1] in ("", "~"):
+            # New alternative is starting
+            return False
+        field = self._field(alternatives[-1])
+        return field is None or not self.fields.is_complete(*field)
+
+    @staticmethod
+    def _parse_term(term):
+        """
+        Parse a query term: "-term" excludes matching documents, "a|b"
+        matches any of the alternatives and "~term" matches the term
+        characters in order, not necessarily adjacent, within the document
+        head.
+
+        Returns:
+          (negative, alternatives) - no alternatives for an incomplete term
+          which is ignored, eg. "-".
+        """
+        negative = term.startswith("-")
+        if negative:
+            term = term[1:]
+        return negative, [alternative for alternative in term.split("|")
+                          if alternative not in ("", "~")]
+
+    def _field(self, term):
+        "Parse a field filter term, None for a free text term"
+        if self.fields is None:
+            return None
+        return self.fields.parse_term(term)
 
-    def search(self, new_query):
+    # Scanned documents between checks for a cancellation.
+    CANCEL_CHECK = 2048
+
+    # Term is searched in all documents, unless the documents matching the
+    # rest of the query are this many times less numerous.
+    TERM_SCAN_RATIO = 4
+
+    # Whole corpus is swept if the scanned scope is larger than its fraction.
+    SWEEP_RATIO = 8
+
+    def search(self, new_query, cancel=None, on_partial=None, partial_size=100):
         """
         Add/remove a character in query - usually at the end.
+
+        Query results are the intersection of results of its terms, minus the
+        results of negative terms; alternative terms are a union of their
+        alternatives. Results of terms over all documents are kept in the term
+        cache, so editing an earlier term or retyping a known one needs no
+        scan.
+
+        Args:
+          cancel: called periodically; returning True aborts the search.
+          on_partial: called once with the first `partial_size` result
+            indices found, before the search completes.
+        Returns:
+          False if the search was cancelled, True otherwise.
         """
         self.query = new_query
         query = self.get_normalized_query()
+        if self.settled is not None and not query.startswith(self.settled[0]):
+            self._remember(*self.settled)
+            self.settled = None
 
         self._invalidate_cache(query)
+        entry = self.history.get(query)
+        if entry is not None and entry[1] is not None and query not in self.cache:
+            # Known from the history, possibly of a previous session
+            self.cache[query] = entry[1]
         cache, cached_query = self._find_best_cache(query)
 
         cached_terms = set(cached_query.split())
@@ -71,54 +413,535 @@ class IncrementalSearch:
 
         if not new_terms:
             self.current_results = cache
-            return
+            self.settled = (query, cache)
+            return True
 
-        # Prepare terms
-        terms_sensitive = set()
-        terms_insensitive = set()
+        # Narrow the base using the field filters and the already known terms
+        # first
+        base = cache
+        base_complete = not cached_query
+        unknown = []
         for term in new_terms:
-            if term == term.lower():
-                terms_insensitive.add(term)
+            negative, alternatives = self._parse_term(term)
+            if not alternatives:
+                continue
+            found = self._known_results(alternatives)
+            if found is None:
+                unknown.append((negative, alternatives, term))
+            elif negative:
+                base = self._difference(base, found)
+                base_complete = False
             else:
-                terms_sensitive.add(term)
-
-        new_results = []
-        for idx in cache:
-            extract = self.extracts[idx]
-            extract_lower = extract.lower()
-            keep = True
-            for term in terms_sensitive:
-                if term not in extract:
-                    keep = False
-                    break
-            if keep:
-                for term in terms_insensitive:
-                    if term not in extract_lower:
-                        keep = False
-                        break
-            if keep:
-                new_results.append(idx)
+                base = self._intersect(base, found)
+                base_complete = False
+
+        # Most selective (longest) positive terms first, then the alternatives
+        # and negative terms
+        unknown.sort(key=lambda item: (item[0], len(item[1]) > 1, -len(item[2])))
+        for i, (negative, alternatives, term) in enumerate(unknown):
+            if not negative and len(alternatives) == 1:
+                # Results are final when nothing else narrows them.
+                last = i == len(unknown) - 1
+                base = self._match(alternatives[0], base, base_complete, cancel,
+                                   on_partial if last else None, partial_size)
+                if base is None:
+                    return False
+                base_complete = False
+                continue
+
+            matching = []
+            for alternative in alternatives:
+                found = self._match(alternative, base, base_complete, cancel)
+                if found is None:
+                    return False
+                matching.append(found)
+            found = self._union(matching)
+            if negative:
+                base = self._difference(base, found)
+            else:
+                base = found
+            base_complete = False
 
         # Remember result
-        self.cache[query] = new_results
-        self.current_results = new_results
+        self.cache[query] = base
+        self.current_results = base
+        self.settled = (query, base)
+        return True
+
+    def _match(self, term, base, base_complete, cancel=None, on_partial=None,
+               partial_size=100):
+        """
+        Find documents from the base matching a single term.
+
+        Returns:
+          array of indices or None if cancelled
+        """
+        field = self._field(term)
+        if field is not None:
+            return self._intersect(base, self.fields.lookup(*field))
+        found = self._term_cache_get(term)
+        if found is not None:
+            return self._intersect(base, found)
+
+        superset = self._find_term_superset(term)
+        if base_complete or len(superset) <= self.TERM_SCAN_RATIO * len(base):
+            # Cheap enough to find the term in all documents and remember.
+            found = self._scan(superset, term, cancel,
+                               on_partial if base_complete else None, partial_size)
+            if found is None:
+                return None
+            self._term_cache_put(term, found)
+            return self._intersect(base, found)
+        return self._scan(base, term, cancel, on_partial, partial_size)
+
+    def _known_results(self, alternatives):
+        "Union of the alternatives results if all are known without a scan"
+        matching = []
+        for alternative in alternatives:
+            field = self._field(alternative)
+            if field is not None:
+                found = self.fields.lookup(*field)
+            else:
+                found = self._term_cache_get(alternative)
+            if found is None:
+                return None
+            matching.append(found)
+        return self._union(matching)
+
+    @staticmethod
+    def _union(matching):
+        "Union of ordered index arrays"
+        if len(matching) == 1:
+            return matching[0]
+        return array('I', sorted(set().union(*matching)))
+
+    @staticmethod
+    def _difference(base, other):
+        "Indices of base not present in other"
+        if not other:
+            return base
+        other = set(other)
+        return array('I', (idx for idx in base if idx not in other))
+
+    def _all(self):
+        "Indices of all documents"
+        if self.removed:
+            removed = self.removed
+            return array('I', (idx for idx in range(len(self.documents))
+                               if idx not in removed))
+        return array('I', range(len(self.documents)))
+
+    def count(self):
+        "Number of searched documents"
+        return len(self.documents) - len(self.removed)
+
+    # Number of remembered settled queries.
+    HISTORY_SIZE = 32
+
+    def _remember(self, query, results):
+        "Count a settled query; the least used one is forgotten"
+        if not query:
+            return
+        if self._is_volatile(query):
+            # Eg. "upd<7d" selects different documents tomorrow
+            results = None
+        entry = self.history.pop(query, None)
+        count = entry[0] + 1 if entry is not None else 1
+        # Reinserted, so the dictionary is ordered from the least recent.
+        self.history[query] = [count, results]
+        if len(self.history) > self.HISTORY_SIZE:
+            # Least used, the least recent among these
+            forgotten = min(self.history, key=lambda query: self.history[query][0])
+            del self.history[forgotten]
+
+    def export_history(self, max_results=10000):
+        """
+        Most used queries for persisting, including the current one.
+
+        Results are returned as documents, as the indices are valid only
+        within this search. Too large results are not exported.
+
+        Returns:
+          list of (query, count, documents or None), the most used first
+        """
+        history = dict(self.history)
+        if self.settled is not None and self.settled[0]:
+            query, results = self.settled
+            if self._is_volatile(query):
+                results = None
+            count = history[query][0] + 1 if query in history else 1
+            history[query] = [count, results]
+        exported = []
+        for query, (count, results) in history.items():
+            if results is not None and len(results) <= max_results:
+                documents = [self.documents[idx] for idx in results]
+            else:
+                documents = None
+            exported.append((query, count, documents))
+        exported.sort(key=lambda entry: entry[1], reverse=True)
+        return exported[:self.HISTORY_SIZE]
+
+    def import_history(self, entries):
+        """
+        Restore the history exported by export_history, eg. by a previous
+        session. Results referencing unknown documents are dropped.
+        """
+        self._index_documents()
+        for query, count, documents in entries:
+            results = None
+            if documents is not None:
+                try:
+                    results = array('I', sorted(self.positions[doc] for doc in documents))
+                except KeyError:
+                    results = None
+            self.history[query] = [count, results]
+
+    def _is_volatile(self, query):
+        "Do the query results depend on the current time"
+        for term in query.split():
+            for alternative in self._parse_term(term)[1]:
+                field = self._field(alternative)
+                if field is not None and self.fields.is_volatile(*field):
+                    return True
+        return False
+
+    # Corpus is rebuilt when this fraction of documents is removed.
+    COMPACT_RATIO = 0.25
+
+    def update_documents(self, changed=None, removed=()):
+        """
+        Add, update or remove documents of a live search.
+
+        Changed documents are appended as new ones and their previous versions
+        are marked as removed. Cached results are patched by checking only the
+        added documents - not by a new scan.
+
+        Args:
+          changed: {document: extract} of new or updated documents
+          removed: removed documents
+        """
+        self._index_documents()
+        # Documents with an unchanged extract are kept in place
+        changed = {
+            doc: extract for doc, extract in (changed or {}).items()
+            if doc not in self.positions or self.extracts[self.positions[doc]] != extract
+        }
+        if not changed and not removed:
+            return
+
+        dropped = set()
+        for doc in list(changed) + list(removed):
+            idx = self.positions.pop(doc, None)
+            if idx is not None:
+                dropped.add(idx)
+        self.removed |= dropped
+
+        first = len(self.documents)
+        extracts = list(changed.values())
+        for idx, doc in enumerate(changed, first):
+            self.positions[doc] = idx
+            self.documents.append(doc)
+        self.extracts.extend(extracts)
+        if self.engine is not None:
+            self.engine.extend(first, extracts)
+        if self.fields is not None:
+            self.fields.extend(first, extracts)
+        if self.ranker is not None:
+            self.ranker.extend(first, extracts)
+
+        if len(self.removed) > len(self.documents) * self.COMPACT_RATIO:
+            self._compact()
+            return
+
+        added = range(first, len(self.documents))
+        current = self.current_results
+        for query, found in list(self.cache.items()):
+            if self._has_field(query):
+                # New field values change the meaning of incomplete filters;
+                # these are cheap to answer again.
+                del self.cache[query]
+                continue
+            self.cache[query] = self._patch(found, query.split(), dropped, added)
+        for query, entry in self.history.items():
+            if entry[1] is None:
+                continue
+            if self._has_field(query):
+                entry[1] = None
+            else:
+                entry[1] = self._patch(entry[1], query.split(), dropped, added)
+        self.settled = None
+        # Term cache holds single alternatives, not query terms - "-a" is
+        # not a negation there.
+        for term, found in self.term_cache.items():
+            patched = self._patch(found, [term], dropped, added, self._matches_one)
+            self.term_cache_size += self._size(patched) - self._size(found)
+            self.term_cache[term] = patched
+        query = self.get_normalized_query()
+        if query in self.cache:
+            self.current_results = self.cache[query]
+        elif self._has_field(query):
+            self.search(self.query)
+        else:
+            self.current_results = self._patch(current, query.split(), dropped, added)
+
+    def _index_documents(self):
+        "Map documents to their indices; documents become a mutable list"
+        if self.positions is None:
+            self.documents = list(self.documents)
+            self.positions = {doc: idx for idx, doc in enumerate(self.documents)}
+
+    def _patch(self, found, terms, dropped, added, matches=None):
+        "Update results of terms after removal and addition of documents"
+        matches = matches or self._matches
+        if dropped:
+            found = array('I', (idx for idx in found if idx not in dropped))
+        else:
+            found = array('I', found)
+        found.extend(
+            idx for idx in added
+            if all(matches(idx, term) for term in terms)
+        )
+        return found
+
+    def _has_field(self, query):
+        "Does the query contain a field filter"
+        return any(
+            self._field(alternative) is not None
+            for term in query.split()
+            for alternative in self._parse_term(term)[1]
+        )
+
+    def _matches(self, idx, term):
+        "Does a single document match the query term"
+        negative, alternatives = self._parse_term(term)
+        if not alternatives:
+            return True
+        return negative != any(self._matches_one(idx, alternative)
+                               for alternative in alternatives)
+
+    def _matches_one(self, idx, term):
+        field = self._field(term)
+        if field is not None:
+            return self.fields.matches(self.extracts[idx], *field)
+        sensitive = term != term.lower()
+        if term.startswith("~"):
+            pattern = self.extracts.fuzzy_pattern(term[1:])
+            return self.extracts.contains_fuzzy(idx, pattern, sensitive)
+        return self.extracts.contains(idx, term, sensitive)
+
+    def match_positions(self, document):
+        """
+        Positions of the current query matches within the document head, for
+        highlighting.
+
+        Fuzzy terms are matched in the shortest window, other free text
+        terms at their first occurrence.
+
+        Returns:
+          (head, sorted list of positions)
+        """
+        self._index_documents()
+        head = self.extracts.head(self.positions[document])
+        head_lower = head.lower()
+        positions = set()
+        for term in self.get_normalized_query().split():
+            negative, alternatives = self._parse_term(term)
+            if negative:
+                continue
+            for alternative in alternatives:
+                if self._field(alternative) is not None:
+                    continue
+                text = head if alternative != alternative.lower() else head_lower
+                if alternative.startswith("~"):
+                    positions.update(self._fuzzy_window(text, alternative[1:]))
+                    continue
+                pos = text.find(alternative)
+                if pos != -1:
+                    positions.update(range(pos, pos + len(alternative)))
+        return head, sorted(positions)
+
+    @staticmethod
+    def _fuzzy_window(text, term):
+        "Positions of the term characters in the shortest window of text"
+        best = []
+        start = text.find(term[0])
+        while start != -1:
+            window = [start]
+            for char in term[1:]:
+                pos = text.find(char, window[-1] + 1)
+                if pos == -1:
+                    return best
+                window.append(pos)
+            if not best or window[-1] - window[0] < best[-1] - best[0]:
+                best = window
+            start = text.find(term[0], start + 1)
+        return best
+
+    def _compact(self):
+        "Drop removed documents from the corpus and clear the caches"
+        live = self._all()
+        extracts = [self.extracts[idx] for idx in live]
+        self.documents = [self.documents[idx] for idx in live]
+        self.positions = {doc: idx for idx, doc in enumerate(self.documents)}
+        self.removed = set()
+        self.extracts = Corpus(extracts)
+        if self.engine_factory is not None:
+            self.engine = self.engine_factory(extracts)
+        if self.fields_factory is not None:
+            self.fields = self.fields_factory(extracts)
+        if self.ranker_factory is not None:
+            self.ranker = self.ranker_factory(extracts)
+        self.cache = {}
+        self.term_cache.clear()
+        self.term_cache_size = 0
+        for entry in self.history.values():
+            entry[1] = None
+        self.settled = None
+        self.current_results = self._all()
+        self.search(self.query)
+
+    def _scan(self, scope, term, cancel=None, on_partial=None, partial_size=100):
+        """
+        Find documents from the scope (ordered indices) containing the term.
+        Lowercase terms are matched case-insensitively.
+
+        Returns:
+          array of indices or None if cancelled
+        """
+        sensitive = term != term.lower()
+        corpus = self.extracts
+        if term.startswith("~"):
+            # Fuzzy term
+            term = corpus.fuzzy_pattern(term[1:])
+            find_all, contains = corpus.find_all_fuzzy, corpus.contains_fuzzy
+        else:
+            find_all, contains = corpus.find_all, corpus.contains
+            if self.engine is not None:
+                candidates = self.engine.candidates(term, sensitive)
+                if candidates is not None:
+                    scope = self._intersect(scope, array('I', sorted(candidates)))
+
+        if len(scope) * self.SWEEP_RATIO >= len(corpus):
+            # Sweeping whole buffer is faster than checking most documents
+            report = on_partial
+            if on_partial is not None and len(scope) != len(corpus):
+                # Hits of the whole buffer are reported only within the scope
+                in_scope = set(scope)
+
+                def report(hits):
+                    hits = [idx for idx in hits if idx in in_scope]
+                    if hits:
+                        on_partial(hits)
+            found = find_all(term, sensitive, cancel, report,
+                             partial_size, self.CANCEL_CHECK)
+            if found is None or len(scope) == len(corpus):
+                return found
+            return self._intersect(scope, found)
+
+        found = array('I')
+        for pos, idx in enumerate(scope):
+            if cancel is not None and pos % self.CANCEL_CHECK == 0 and cancel():
+                return None
+            if contains(idx, term, sensitive):
+                found.append(idx)
+                if on_partial is not None and len(found) == partial_size:
+                    on_partial(list(found))
+        return found
+
+    @staticmethod
+    def _intersect(base, other):
+        "Intersection of two ordered index arrays"
+        if len(other) < len(base):
+            base, other = other, base
+        if len(base) * 16 < len(other):
+            # Much smaller set - binary search the larger one
+            found = array('I')
+            size = len(other)
+            for idx in base:
+                pos = bisect_left(other, idx)
+                if pos < size and other[pos] == idx:
+                    found.append(idx)
+            return found
+        other = set(other)
+        return array('I', (idx for idx in base if idx in other))
+
+    def _term_cache_get(self, term):
+        found = self.term_cache.get(term)
+        if found is not None:
+            self.term_cache.move_to_end(term)
+        return found
+
+    def _term_cache_put(self, term, found):
+        "Remember term results, evicting the least recently used over the budget"
+        if term in self.term_cache:
+            self.term_cache_size -= self._size(self.term_cache.pop(term))
+        self.term_cache[term] = found
+        self.term_cache_size += self._size(found)
+        while self.term_cache_size > self.term_cache_memory and len(self.term_cache) > 1:
+            _, evicted = self.term_cache.popitem(last=False)
+            self.term_cache_size -= self._size(evicted)
+
+    @staticmethod
+    def _size(results):
+        return results.itemsize * len(results)
+
+    def memory_usage(self):
+        "Approximate memory used by the search structures, in bytes"
+        usage = {
+            'corpus': self.extracts.memory_usage(),
+            'query_cache': sum(self._size(found) for found in self.cache.values()),
+            'term_cache': self.term_cache_size,
+        }
+        if self.engine is not None:
+            usage['engine'] = self.engine.memory_usage()
+        if self.fields is not None:
+            usage['fields'] = self.fields.memory_usage()
+        return usage
+
+    def _find_term_superset(self, term):
+        """
+        Smallest cached result of a term implied by the given one - its
+        substring matched in the same or a less strict case mode. All
+        documents if there's none.
+
+        Fuzzy terms are implied only by the fuzzy terms, as they match
+        more documents than the plain ones.
+        """
+        best = None
+        term_lower = term.lower()
+        sensitive = term != term_lower
+        fuzzy = term.startswith("~")
+        for cached_term, found in self.term_cache.items():
+            if cached_term.startswith("~") != fuzzy:
+                continue
+            if cached_term == cached_term.lower():
+                implied = cached_term in term_lower
+            else:
+                implied = sensitive and cached_term in term
+            if implied and (best is None or len(found) < len(best)):
+                best = found
+        if best is None:
+            return self._all()
+        return best
 
     @staticmethod
     def recursive_extract_fn(document):
-        "Extract data from dictionary resursively as string"
+        """
+        Extract data from dictionary resursively as string.
+
+        Iterates with an explicit stack; values of unknown types are
+        converted with str().
+        """
         parts = []
-        if isinstance(document, dict):
-            for key, subvalue in document.items():
-                parts.append(IncrementalSearch.recursive_extract_fn(subvalue))
-        elif isinstance(document, (list, set)):
-            for element in document:
-                parts.append(IncrementalSearch.recursive_extract_fn(element))
-        elif isinstance(document, (int, float)):
-            parts.append(str(document))
-        elif isinstance(document, str):
-            parts.append(document)
-        elif document is None:
-            return ""
-        else:
-            raise Exception(f"Type {type(document)} is unhandled")
+        stack = [document]
+        while stack:
+            value = stack.pop()
+            if isinstance(value, str):
+                parts.append(value)
+            elif isinstance(value, dict):
+                stack.extend(reversed(list(value.values())))
+            elif isinstance(value, (list, tuple, set)):
+                stack.extend(reversed(list(value)))
+            elif value is not None:
+                parts.append(str(value))
         return " ".join(parts)
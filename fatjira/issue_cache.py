@@ -1,8 +1,19 @@
 from time import time
 from datetime import datetime
+import hashlib
+import json
+import os
+import mmap
+import pickle
+import struct
+import threading
+from queue import Queue, Full
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 from fatjira import log
-import shelve
+from fatjira.storage import open_storage, Codec
+from fatjira.projection import Projection
+from fatjira.extract import compile_spec, spec_version, build_extracts, DEFAULT_SPEC
 
 
 class IssueCache:
@@ -13,17 +24,58 @@ class IssueCache:
     - Incremental synchronization.
     """
 
+    # Memory of the recently decoded issues when no budget is set.
+    RAW_CACHE_MEMORY = 16 * 2**20
+    # Decoded issue takes roughly this many times its JSON size.
+    RAW_OVERHEAD = 3
+
     def __init__(self, config, jira):
         self.jira = jira
-        # TODO: Shelve is slow, move to xapian? Maaaybe?
-        # Reading 5000 issues from disc takes 1.2s (109MB file)
-        # NOTE: for 4000 issues seem fast enough.
-        self.shelve = shelve.open(config['cache_path'])
+        # Shelve is a legacy backend: reading 5000 issues from disc takes 1.2s
+        # (109MB file). SQLite reads them in fraction of that.
+        codec = Codec(config.get('cache_compression'),
+                      config.get('cache_compression_level', 6),
+                      config.get('cache_compression_dict', True))
+        self.storage = open_storage(config.get('cache_backend', 'shelve'),
+                                    config['cache_path'], codec)
+        # Search extracts are computed when storing issues.
+        self.extract_spec = config.get('extract_spec') or DEFAULT_SPEC
+        self.extract_fn = compile_spec(self.extract_spec)
+        self.extract_version = spec_version(self.extract_spec)
+        # Processes recomputing extracts after the spec changes.
+        self.extract_processes = config.get('extract_processes', 1)
+        # Extract version of a fresh cache was checked and stamped
+        self._extracts_stamped = False
+        # All issues in a single file, for reading them at once.
+        self.snapshot_path = config['cache_path'] + ".snapshot"
+        self.snapshot = config.get('cache_snapshot', False)
 
         self.issue_filter = config['issue_filter']
         self.field_filter = config['field_filter']
         self.sync_since = config['sync_since']
+        # True reads worklogs per issue, 'bulk' reads only worklogs updated
+        # since the last sync.
         self.sync_worklogs = config['sync_worklogs']
+        self.bulk_worklogs = self.sync_worklogs == 'bulk'
+        # Issues with altered spent time - their worklogs could get deleted.
+        self._timespent_changed = set()
+
+        # Drop unused parts of issues and worklogs at ingest.
+        projection = config.get('payload_projection')
+        if projection is True:
+            self.projection = Projection()
+        elif projection:
+            self.projection = Projection(projection)
+        else:
+            self.projection = None
+        # Number of stored issues committed together with the watermark.
+        self.commit_interval = config.get('commit_interval', 250)
+        # Overlap searching, reading worklogs and storing of subsequent pages.
+        self.sync_pipeline = config.get('sync_pipeline', False)
+        # Additional JQL conditions splitting the initial sync into
+        # independent, concurrently synchronized shards.
+        self.sync_shards = config.get('sync_shards', [])
+        self.sync_shard_threads = config.get('sync_shard_threads', 4)
 
         # Totals
         self.took_worklogs = 0
@@ -32,9 +84,30 @@ class IssueCache:
         self.took_searches = 0
         self.total_read = 0
         self.update_start = 0
+        # Change detection stats
+        self.issues_new = 0
+        self.issues_changed = 0
+        self.issues_unchanged = 0
+        self.worklogs_read = 0
 
         self.pool = ThreadPoolExecutor(max_workers=config['threads'])
 
+        # Called with {key: extract} of issues changed by a committed update.
+        self.listeners = []
+
+        # Memory budget in MB of the decoded issues and the search state.
+        # None keeps the defaults of each part.
+        self.memory_budget = config.get('memory_budget')
+        # Recently displayed issues, so redrawing them doesn't decode them
+        # again. Least recently used are evicted over the budget.
+        self.raw_cache = OrderedDict()
+        self.raw_cache_size = 0
+        if self.memory_budget:
+            self.raw_cache_memory = self.memory_budget * 2**20 // 8
+        else:
+            self.raw_cache_memory = self.RAW_CACHE_MEMORY
+        self._raw_lock = threading.Lock()
+
         assert self.field_filter is None or isinstance(self.field_filter, list)
         assert isinstance(self.issue_filter, str)
 
@@ -48,80 +121,344 @@ class IssueCache:
         return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M")
 
     def load_field_mapping(self):
-        "Load field mapping from shelve"
-        self._fields = self.shelve['_fields']
+        "Load field mapping from storage"
+        self._fields = self.storage.get_meta('fields')
         self._field_by_name = {field['name']: field['id'] for field in self._fields}
         self._field_by_id = {field['id']: field['name'] for field in self._fields}
 
     def get_status(self):
         """
-        Read status from shelve, handle defaults.
+        Read status from storage, handle defaults.
         """
-        status = self.shelve.get('_update_status', {
+        status = {
             # Date of the last issue.
             'last_updated': self._parse_time(self.sync_since),
             'issues_read': 0,
 
             'fields_update_ts': 0,
             'issues_update_ts': 0,
-        })
+
+            # Watermarks of an initial sync split into shards: {jql: ts}
+            'shards': {},
+            'shards_started': 0,
+
+            # Bulk worklog sync watermark in ms - as used by the Jira API.
+            'worklogs_since': int(self._parse_time(self.sync_since) * 1000),
+
+            # Incremented on each change of stored issues.
+            'generation': 0,
+        }
+        status.update(self.storage.get_meta('update_status', {}))
         return status
 
     def update_status(self, **kwargs):
         """
-        Update status
+        Update status.
+
+        Not flushed by itself - wrap in a storage transaction to commit it
+        together with the related data.
         """
         status = self.get_status()
         for key, value in kwargs.items():
             if key not in status:
                 raise Exception(f"Status {status} doesn't have key {key} - recreate DB")
             status[key] = value
-        self.shelve['_update_status'] = status
-        self.shelve.sync()
+        self.storage.put_meta('update_status', status)
         ips = status['issues_read'] / (time() - self.update_start)
         log.info("Updating status: last_updated=%s read=%d, issues/s=%.2f",
                  self._format_time(status['last_updated']), status['issues_read'], ips)
 
-    def update_issues(self):
+    def update_issues(self, shard=None):
         """
         Update local cache for configured projects in an incremental way.
 
-        # TODO: Parallelize
+        In a pipelined mode the next search page is read in background while
+        worklogs of the current page are read in the thread pool, and the
+        previous page is stored. Pages are still stored in order, so the
+        watermark only moves forward over fully stored pages.
+
+        Args:
+          shard: Additional JQL condition, synchronized with its own watermark.
         """
+        issue_filter = self.issue_filter
+        if shard is not None:
+            issue_filter = f'({issue_filter}) and ({shard})'
+
         while True:
-            status = self.get_status()
             # Create query
-            last_updated = self._format_time(status['last_updated'])
+            last_updated = self._format_time(self._get_watermark(shard))
             query = (
-                f'({self.issue_filter}) and updated >= "{last_updated}" ORDER BY updated ASC'
+                f'({issue_filter}) and updated >= "{last_updated}" ORDER BY updated ASC'
             )
-            for page_no, page in self._read_pages(query):
+            pages = self._read_pages(query)
+            if self.sync_pipeline:
+                pages = self._prefetch(pages, depth=1)
+
+            # Page with worklogs being read, waiting to be stored.
+            in_flight = None
+            for page_no, page in pages:
+                started = self._start_page(page) if page else None
+                if in_flight is not None:
+                    self._finish_page(in_flight, shard)
+                in_flight = started
+
                 if not page:
-                    self.update_status(issues_update_ts=time())
+                    if shard is None:
+                        with self.storage.transaction():
+                            self.update_status(issues_update_ts=time())
+                    return
+
+                if not self.sync_pipeline:
+                    self._finish_page(in_flight, shard)
+                    in_flight = None
+
+            if in_flight is not None:
+                self._finish_page(in_flight, shard)
+
+    def _get_watermark(self, shard):
+        status = self.get_status()
+        if shard is None:
+            return status['last_updated']
+        return status['shards'].get(shard, self._parse_time(self.sync_since))
+
+    def needs_sharded_sync(self):
+        "Initial sync with configured shards was not yet finished"
+        if not self.sync_shards:
+            return False
+        status = self.get_status()
+        return bool(status['shards']) or status['issues_update_ts'] == 0
+
+    def update_shards(self):
+        """
+        Initial synchronization split into concurrently synchronized shards.
+
+        Each shard keeps its own watermark, so an interrupted sync resumes each
+        shard independently. When all are done, the incremental sync continues
+        using a single watermark.
+        """
+        status = self.get_status()
+        if not status['shards']:
+            with self.storage.transaction():
+                self.update_status(
+                    shards={shard: self._parse_time(self.sync_since)
+                            for shard in self.sync_shards},
+                    shards_started=time()
+                )
+            status = self.get_status()
+
+        shards = list(status['shards'])
+        log.info("Synchronizing %d shards using %d threads",
+                 len(shards), self.sync_shard_threads)
+        with ThreadPoolExecutor(max_workers=self.sync_shard_threads) as pool:
+            # Propagates the first failure
+            list(pool.map(self.update_issues, shards))
+
+        # All shards caught up with the time of the sync start. Margin covers
+        # for a clock skew between the Jira server and us.
+        with self.storage.transaction():
+            self.update_status(last_updated=status['shards_started'] - 15 * 60,
+                               shards={},
+                               issues_update_ts=time())
+
+    def _start_page(self, page):
+        "Detect changes and start reading stale worklogs in the thread pool"
+        start = time()
+        changes = self._detect_changes(page)
+        futures = []
+        if self.sync_worklogs:
+            stale = [issue for issue, change in zip(page, changes)
+                     if change == 'worklogs']
+            log.info("Synchronizing worklogs for %d of %d issues on a page",
+                     len(stale), len(page))
+            futures = [self.pool.submit(self.read_worklogs, issue)
+                       for issue in stale]
+        return page, changes, futures, start
+
+    def _finish_page(self, in_flight, shard):
+        "Wait for the worklogs and store the page"
+        page, changes, futures, start = in_flight
+        # Timeout is huge to only kill hunged --update automats.
+        deadline = time() + 30 + len(futures) * 20
+        for future in futures:
+            future.result(timeout=max(0, deadline - time()))
+        self._store_page(page, changes, shard)
+        self.took_worklogs_and_store += time() - start
+
+    def _prefetch(self, iterator, depth):
+        """
+        Consume iterator in a background thread staying up to `depth` items
+        ahead of the reader.
+        """
+        queue = Queue(maxsize=depth)
+        stop = threading.Event()
+        end = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.5)
                     return
+                except Full:
+                    continue
+
+        def producer():
+            try:
+                for item in iterator:
+                    put((item, None))
+                    if stop.is_set():
+                        return
+            except Exception as ex:
+                put((end, ex))
+                return
+            put((end, None))
+
+        thread = threading.Thread(target=producer, name="prefetch", daemon=True)
+        thread.start()
+        try:
+            while True:
+                item, error = queue.get()
+                if error is not None:
+                    raise error
+                if item is end:
+                    return
+                yield item
+        finally:
+            stop.set()
+
+    @staticmethod
+    def _content_hash(raw):
+        "Hash of the issue content, excluding separately synchronized worklogs"
+        fields = {
+            name: value
+            for name, value in raw['fields'].items()
+            if name != 'worklog'
+        }
+        dump = json.dumps(fields, sort_keys=True, default=str)
+        return hashlib.sha1(dump.encode('utf-8')).hexdigest()
+
+    def _detect_changes(self, page):
+        """
+        Compare incoming issues with the cached ones.
+
+        Issues re-read within the minute-granular overlap window are usually
+        unchanged and don't need to be stored again. Worklogs are carried over
+        from the cache unless the spent time changed.
+
+        With bulk worklogs, only new issues created before the bulk watermark
+        have their worklogs read - the older ones are never reported by the
+        bulk API.
+
+        Returns:
+          list of changes for each issue on page: 'unchanged', 'changed'
+          (worklogs carried over) or 'worklogs' (worklogs need reading).
+        """
+        changes = []
+        worklogs_since = self.get_status()['worklogs_since']
+        for issue in page:
+            raw = issue.raw
+            if self.projection is not None:
+                self.projection.issue(raw)
+            # Synced issues would only evict the displayed ones from the LRU
+            cached = self.storage.get(issue.key)
+            if cached is None:
+                self.issues_new += 1
+                if self.bulk_worklogs and not self._predates_bulk(raw, worklogs_since):
+                    changes.append('changed')
+                else:
+                    changes.append('worklogs')
+                continue
+
+            fields, cached_fields = raw['fields'], cached['fields']
+            worklog = cached_fields.get('worklog')
+            if self.bulk_worklogs:
+                if fields.get('timespent') != cached_fields.get('timespent'):
+                    self._timespent_changed.add(issue.key)
+                stale_worklogs = False
+            else:
+                stale_worklogs = self.sync_worklogs and bool(fields.get('timespent')) and (
+                    fields.get('timespent') != cached_fields.get('timespent') or
+                    worklog is None or
+                    (fields.get('worklog') is not None and
+                     fields['worklog'].get('total') != worklog.get('total'))
+                )
+            if (not stale_worklogs and fields.get('timespent') and
+                worklog is not None and 'worklog' not in fields):
+                fields['worklog'] = worklog
+
+            if (not stale_worklogs and
+                fields.get('updated') == cached_fields.get('updated') and
+                self._content_hash(raw) == self._content_hash(cached)):
+                self.issues_unchanged += 1
+                changes.append('unchanged')
+                continue
+
+            self.issues_changed += 1
+            changes.append('worklogs' if stale_worklogs else 'changed')
+        return changes
+
+    def _predates_bulk(self, raw, worklogs_since):
+        "Can the issue have worklogs updated before the bulk watermark?"
+        fields = raw['fields']
+        if not fields.get('timespent'):
+            return False
+        if fields.get('created') is None:
+            return True
+        return self._parse_time(fields['created']) * 1000 < worklogs_since
+
+    def subscribe(self, listener):
+        """
+        Register a listener of issue changes.
+
+        Listener is called with {key: extract} of changed issues and the
+        generation of the cache they were committed with, after each commit -
+        possibly from a sync thread.
+        """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    def _emit(self, changed, generation):
+        "Notify listeners about changes committed with a given generation"
+        if not changed:
+            return
+        for listener in list(self.listeners):
+            try:
+                listener(changed, generation)
+            except Exception:
+                log.exception("Issue change listener failed")
+
+    def _store_page(self, page, changes, shard):
+        """
+        Store changed issues in batches of commit_interval size.
+
+        Each batch is committed along with the watermark of its last issue, so
+        an interrupted update resumes from the last committed issue.
+        """
+        interval = max(1, self.commit_interval)
+        for batch_start in range(0, len(page), interval):
+            batch_end = batch_start + interval
+            batch = page[batch_start:batch_end]
+            self.storage.prime([issue.raw for issue in batch])
+            changed = {}
+            with self.storage.transaction():
+                self._stamp_extract_version()
+                for issue, change in zip(batch, changes[batch_start:batch_end]):
+                    if change != 'unchanged':
+                        changed[issue.key] = self._put(issue.key, issue.raw)
+                if changed:
+                    self._bump_generation()
 
-                start = time()
-                if self.sync_worklogs:
-                    log.info("Synchronizing worklogs for %d issues on a page",
-                             len(page))
-                    # Timeout is huge to only kill hunged --update automats.
-                    page = self.pool.map(self.read_worklogs, page,
-                                         timeout=30 + len(page) * 20)
-
-                for i, issue in enumerate(page):
-                    raw = issue.raw
-                    # TODO: Compare existing entries with new ones to update stats better.
-                    self.shelve[issue.key] = raw
-                    status['issues_read'] += 1
-                    status['last_updated'] = self._parse_time(issue.fields.updated)
-                    if i % 20 == 0:
-                        # Store periodically; reading worklogs can take a lot of time.
-                        self.update_status(issues_read=status['issues_read'],
-                                           last_updated=status['last_updated'])
-
-                self.update_status(issues_read=status['issues_read'],
-                                   last_updated=status['last_updated'])
-                self.took_worklogs_and_store += time() - start
+                status = self.get_status()
+                last_updated = self._parse_time(batch[-1].fields.updated)
+                if shard is None:
+                    watermark = {'last_updated': last_updated}
+                else:
+                    status['shards'][shard] = last_updated
+                    watermark = {'shards': status['shards']}
+                self.update_status(issues_read=status['issues_read'] + len(batch),
+                                   **watermark)
+            self._emit(changed, status['generation'])
 
     def read_worklogs(self, issue):
         """
@@ -135,25 +472,253 @@ class IssueCache:
         start = time()
         worklogs = self.jira.link.worklogs(issue.key)
         self.took_worklogs += time() - start
+        worklogs = [worklog.raw for worklog in worklogs]
+        if self.projection is not None:
+            worklogs = self.projection.worklogs(worklogs)
         # Simulate a structure jira module normally uses when
         # reading worklogs.
-        # FIXME: This returns a lot of unnecessary information.
         issue.raw['fields']['worklog'] = {
             'total': len(worklogs),
-            'worklogs': [
-                worklog.raw
-                for worklog in worklogs
-            ]
+            'worklogs': worklogs,
         }
         return issue
 
+    def update_worklogs(self):
+        """
+        Synchronize worklogs updated since the last run using the bulk API.
+
+        Cost scales with the number of changed worklogs instead of the number
+        of issues. Deleted worklogs are removed from issues with an altered
+        spent time, as removing a worklog changes it.
+        """
+        since = self.get_status()['worklogs_since']
+        deleted = set()
+        while True:
+            response = self.jira.worklogs_deleted(since)
+            deleted.update(str(value['worklogId']) for value in response['values'])
+            if response['lastPage']:
+                break
+            since = response['until']
+
+        since = self.get_status()['worklogs_since']
+        while True:
+            start = time()
+            response = self.jira.worklogs_updated(since)
+            ids = [value['worklogId'] for value in response['values']]
+            worklogs = []
+            for i in range(0, len(ids), 1000):
+                worklogs += self.jira.worklogs_list(ids[i:i + 1000])
+            self.took_worklogs += time() - start
+            self.worklogs_read += len(worklogs)
+
+            with self.storage.transaction():
+                changed = self._merge_worklogs(worklogs, deleted)
+                self.update_status(worklogs_since=response['until'])
+                generation = self.get_status()['generation']
+            self._emit(changed, generation)
+            log.info("Stat: %d worklogs read in bulk, %d deleted",
+                     self.worklogs_read, len(deleted))
+            if response['lastPage']:
+                break
+            since = response['until']
+
+        if self._timespent_changed and deleted:
+            with self.storage.transaction():
+                changed = self._merge_worklogs([], deleted, self._timespent_changed)
+                generation = self.get_status()['generation']
+            self._emit(changed, generation)
+        self._timespent_changed.clear()
+
+    def _merge_worklogs(self, worklogs, deleted, keys=()):
+        """
+        Replace worklogs by ID within the cached issues and drop the deleted ones.
+
+        Args:
+          worklogs: worklogs read from the bulk API
+          deleted: IDs of deleted worklogs
+          keys: additional issues to clean from the deleted worklogs
+        Returns:
+          {key: extract} of the changed issues
+        """
+        if self.projection is not None:
+            worklogs = self.projection.worklogs(worklogs)
+        by_issue = {}
+        for worklog in worklogs:
+            by_issue.setdefault(str(worklog['issueId']), []).append(worklog)
+
+        key_by_id = self.storage.keys_for_ids(by_issue)
+        keys = set(keys) | set(key_by_id.values())
+        changed = {}
+        for key, raw in self.storage.items(keys):
+            current = raw['fields'].get('worklog') or {}
+            merged = {
+                str(worklog['id']): worklog
+                for worklog in current.get('worklogs', [])
+            }
+            for worklog in by_issue.get(str(raw['id']), []):
+                merged[str(worklog['id'])] = worklog
+            for worklog_id in deleted & merged.keys():
+                del merged[worklog_id]
+
+            ordered = sorted(merged.values(), key=lambda worklog: worklog['started'])
+            if ordered:
+                raw['fields']['worklog'] = {
+                    'total': len(ordered),
+                    'worklogs': ordered,
+                }
+            else:
+                raw['fields'].pop('worklog', None)
+            changed[key] = self._put(key, raw)
+        if keys:
+            self._bump_generation()
+        return changed
+
+    def _put(self, key, raw):
+        "Store issue along with its search extract, return the extract"
+        extract = self.extract_fn(raw)
+        self.storage.put(key, raw, extract)
+        self._forget_raw(key)
+        return extract
+
+    def _stamp_extract_version(self):
+        """
+        Mark the extracts of a fresh cache as current - all of them are
+        created by this extractor. Caches with extracts of an older version
+        stay unmarked, to be recomputed. Call within a transaction.
+        """
+        if self._extracts_stamped:
+            return
+        version = self.storage.get_meta('extract_version')
+        if version is None and not self.storage.keys():
+            self.storage.put_meta('extract_version', self.extract_version)
+        self._extracts_stamped = True
+
+    def load_extracts(self):
+        """
+        Read search extracts of all issues without decoding the issues.
+
+        Extracts missing in the storage or created by an older extractor
+        are recomputed and persisted.
+
+        Returns:
+          (keys, extracts) lists
+        """
+        rows = self.storage.extracts()
+        stale = self.storage.get_meta('extract_version') != self.extract_version
+        missing = [key for key, extract in rows if stale or extract is None]
+        if not missing:
+            return [key for key, _ in rows], [extract for _, extract in rows]
+
+        log.info("Recomputing %d search extracts", len(missing))
+        extracts = dict(rows)
+        items = list(self.storage.items(missing))
+        computed = build_extracts([raw for _, raw in items], self.extract_spec,
+                                  processes=self.extract_processes)
+        with self.storage.transaction():
+            for (key, raw), extract in zip(items, computed):
+                extracts[key] = extract
+                self.storage.put_extract(key, extract)
+            self.storage.put_meta('extract_version', self.extract_version)
+        keys = list(extracts)
+        return keys, [extracts[key] for key in keys]
+
+    def save_query_cache(self, entries, generation):
+        """
+        Persist the most used search queries along with their results.
+
+        Results are tagged with the generation of the issues they were
+        computed from - they are valid only until the next change of issues.
+
+        Args:
+          entries: list of (query, count, keys or None)
+          generation: generation of the cache the results reflect
+        """
+        with self.storage.transaction():
+            self.storage.put_meta('query_cache', {
+                'generation': generation,
+                'queries': [list(entry) for entry in entries],
+            })
+
+    def load_query_cache(self):
+        """
+        Read the persisted search queries.
+
+        Results of a cache changed since they were saved are dropped - the
+        query usage counts are kept.
+
+        Returns:
+          list of (query, count, keys or None)
+        """
+        saved = self.storage.get_meta('query_cache')
+        if not saved:
+            return []
+        fresh = saved['generation'] == self.get_status()['generation']
+        return [
+            (query, count, keys if fresh else None)
+            for query, count, keys in saved['queries']
+        ]
+
+    def _bump_generation(self):
+        "Mark change of the stored issues. Call within a transaction."
+        self.update_status(generation=self.get_status()['generation'] + 1)
+
+    def write_snapshot(self):
+        """
+        Write all issues into a single file for a fast start.
+
+        File starts with a generation of the cache it was created from,
+        followed by a pickled list of issues.
+        """
+        generation = self.get_status()['generation']
+        if self._snapshot_generation() == generation:
+            return
+        start = time()
+        issues = [raw for key, raw in self.storage.items()]
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as snapshot:
+            snapshot.write(struct.pack("<Q", generation))
+            pickle.dump(issues, snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.snapshot_path)
+        log.info("Snapshot of %d issues written in %.2fs", len(issues), time() - start)
+
+    def _snapshot_generation(self):
+        try:
+            with open(self.snapshot_path, "rb") as snapshot:
+                return struct.unpack("<Q", snapshot.read(8))[0]
+        except (OSError, struct.error):
+            return None
+
+    def load_snapshot(self):
+        """
+        Read all issues from the snapshot with a single sequential read.
+
+        Returns:
+          list of raw issues or None when the snapshot is missing or stale.
+        """
+        if not self.snapshot:
+            return None
+        generation = self.get_status()['generation']
+        try:
+            with open(self.snapshot_path, "rb") as snapshot:
+                with mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    if struct.unpack("<Q", data[:8])[0] != generation:
+                        log.info("Snapshot is stale, reading issues one by one")
+                        return None
+                    # Unpickle directly from the mapped memory, without a copy.
+                    with memoryview(data) as view, view[8:] as body:
+                        return pickle.loads(body)
+        except (OSError, ValueError, struct.error, pickle.UnpicklingError):
+            log.exception("Unable to read the snapshot")
+            return None
+
     def update_fields(self):
         """
         Update field cache.
         """
         fields = self.jira.link.fields()
-        self.shelve['_fields'] = fields
-        self.update_status(fields_update_ts=time())
+        with self.storage.transaction():
+            self.storage.put_meta('fields', fields)
+            self.update_status(fields_update_ts=time())
 
     def update(self):
         "Full update"
@@ -162,10 +727,18 @@ class IssueCache:
                 return False
             self.update_start = time()
             self.update_fields()
+            if self.needs_sharded_sync():
+                self.update_shards()
             self.update_issues()
+            if self.bulk_worklogs:
+                self.update_worklogs()
+            if self.snapshot:
+                self.write_snapshot()
             log.info("Field and issue update took %.2f", time() - self.update_start)
+            if self.projection is not None:
+                log.info(self.projection.report())
         finally:
-            self.shelve.sync()
+            self.storage.sync()
 
         return True
 
@@ -188,9 +761,10 @@ class IssueCache:
             start_at += len(results)
             self.total_read += len(results)
             yield (page, results)
-            log.info("Stat: %d read; searches %.2fs worklogs/store %.2fs "
-                     "worklog_read %.2fs thread",
-                     self.total_read, self.took_searches,
+            log.info("Stat: %d read (%d new, %d changed, %d unchanged); "
+                     "searches %.2fs worklogs/store %.2fs worklog_read %.2fs thread",
+                     self.total_read, self.issues_new, self.issues_changed,
+                     self.issues_unchanged, self.took_searches,
                      self.took_worklogs_and_store, self.took_worklogs)
             # NOTE: Yield empty page at least once to denote that there's no more
             # data in this query.
@@ -199,11 +773,36 @@ class IssueCache:
 
     def issue_list(self):
         "Keys of all cached issues"
-        return [
-            key
-            for key in self.shelve.keys()
-            if not key.startswith("_")
-        ]
+        return self.storage.keys()
 
     def get_raw(self, key):
-        return self.shelve.get(key, None)
+        "Decoded issue, None if not cached"
+        with self._raw_lock:
+            entry = self.raw_cache.get(key)
+            if entry is not None:
+                self.raw_cache.move_to_end(key)
+                return entry[0]
+        raw = self.storage.get(key)
+        if raw is None:
+            return None
+        size = self.RAW_OVERHEAD * len(json.dumps(raw, default=str))
+        with self._raw_lock:
+            if key in self.raw_cache:
+                self.raw_cache_size -= self.raw_cache.pop(key)[1]
+            self.raw_cache[key] = (raw, size)
+            self.raw_cache_size += size
+            while self.raw_cache_size > self.raw_cache_memory and len(self.raw_cache) > 1:
+                _, (_, evicted) = self.raw_cache.popitem(last=False)
+                self.raw_cache_size -= evicted
+        return raw
+
+    def _forget_raw(self, key):
+        "Drop a stored issue from the decoded ones"
+        with self._raw_lock:
+            entry = self.raw_cache.pop(key, None)
+            if entry is not None:
+                self.raw_cache_size -= entry[1]
+
+    def memory_usage(self):
+        "Estimated size of the decoded issues in bytes"
+        return {'raws': self.raw_cache_size}
@@ -62,7 +62,8 @@ def main():
 
     # Connect to Jira first. FIXME: Do it lazily in background
     setup_logging()
-    jira_service = ServiceJira(config.JIRA, config.ISSUES)
+    search_config = getattr(config, 'SEARCH', {})
+    jira_service = ServiceJira(config.JIRA, config.ISSUES, search_config)
     if not args.offline:
         jira_service.connect()
 
@@ -89,4 +90,9 @@ def main():
         logging.info("Executing shell")
         return shell(app)
 
-    return app.loop()
+    if search_config.get('preload', False):
+        jira_service.search.start()
+    try:
+        return app.loop()
+    finally:
+        jira_service.close()
@@ -0,0 +1,111 @@
+"""
+Slim down Jira payloads before storing them in the cache.
+
+Jira repeats full user objects (avatar URLs, self links, time zones) in every
+issue and worklog. Only the fields used by templates and search are kept.
+"""
+import json
+
+
+# Kept keys of nested objects by their kind.
+DEFAULT_PROJECTION = {
+    'user': ['name', 'key', 'displayName', 'emailAddress', 'active'],
+    'status': ['id', 'name', 'statusCategory'],
+    'statusCategory': ['id', 'key', 'name'],
+    'priority': ['id', 'name'],
+    'issuetype': ['id', 'name', 'subtask'],
+    'project': ['id', 'key', 'name'],
+    'worklog': ['id', 'issueId', 'author', 'updateAuthor', 'comment',
+                'started', 'created', 'updated', 'timeSpent', 'timeSpentSeconds'],
+}
+
+# Kind of the objects stored in issue fields.
+FIELD_KINDS = {
+    'assignee': 'user',
+    'reporter': 'user',
+    'creator': 'user',
+    'status': 'status',
+    'priority': 'priority',
+    'issuetype': 'issuetype',
+    'project': 'project',
+}
+
+# Kind of the objects nested within the projected objects.
+NESTED_KINDS = {
+    'author': 'user',
+    'updateAuthor': 'user',
+    'statusCategory': 'statusCategory',
+}
+
+
+class Projection:
+    """
+    Apply a projection to issues and worklogs at ingest.
+
+    Args:
+      spec: {kind: [kept keys]} dictionary merged with the DEFAULT_PROJECTION.
+    """
+
+    def __init__(self, spec=None):
+        self.spec = dict(DEFAULT_PROJECTION)
+        if spec:
+            self.spec.update(spec)
+
+        # Stats
+        self.issues = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    def project(self, obj, kind):
+        "Project a single object of a given kind"
+        if not isinstance(obj, dict):
+            return obj
+        kept = {}
+        for key in self.spec[kind]:
+            if key not in obj:
+                continue
+            value = obj[key]
+            nested = NESTED_KINDS.get(key)
+            if nested is not None:
+                value = self.project(value, nested)
+            kept[key] = value
+        return kept
+
+    def worklog(self, raw):
+        return self.project(raw, 'worklog')
+
+    def worklogs(self, raws):
+        "Project a list of worklogs read separately from the issue"
+        projected = [self.worklog(raw) for raw in raws]
+        self.bytes_before += len(json.dumps(raws))
+        self.bytes_after += len(json.dumps(projected))
+        return projected
+
+    def issue(self, raw):
+        "Project issue fields in place and measure saved space"
+        before = len(json.dumps(raw))
+        fields = raw['fields']
+        for field, kind in FIELD_KINDS.items():
+            if fields.get(field) is not None:
+                fields[field] = self.project(fields[field], kind)
+
+        worklog = fields.get('worklog')
+        if worklog and worklog.get('worklogs'):
+            worklog['worklogs'] = [
+                self.worklog(entry) for entry in worklog['worklogs']
+            ]
+
+        after = len(json.dumps(raw))
+        self.issues += 1
+        self.bytes_before += before
+        self.bytes_after += after
+        return raw
+
+    def report(self):
+        "Describe space saved per issue"
+        if not self.issues:
+            return "projection: no issues"
+        saved = (self.bytes_before - self.bytes_after) / self.issues
+        ratio = self.bytes_after / self.bytes_before
+        return (f"projection: {self.issues} issues, {saved:.0f} bytes saved per "
+                f"issue, stored {ratio * 100:.0f}% of the original size")
@@ -0,0 +1,128 @@
+"""
+Ranking of the search results - only the displayed top is ever sorted.
+"""
+import heapq
+from array import array
+
+from fatjira.extract import (
+    DESCRIPTION_START, FIELDS_START, extract_columns, extract_fields,
+)
+
+
+class Ranker:
+    """
+    Score documents by the location of the matched terms, their recency and
+    by being assigned to the current user.
+
+    Static part of the score is computed once from the extracts; only the
+    match location is computed per query, and only for ranked results.
+
+    Args:
+      extracts: list of searched texts
+      me: name of the current user
+    """
+
+    # Score of a term matched in a key or a summary; a description scores 0.
+    KEY = 4.0
+    SUMMARY = 2.0
+    # Score of the assigned issues
+    ASSIGNED = 2.0
+    # Score of the most recently updated issue, the oldest one has 0.
+    RECENCY = 1.0
+
+    def __init__(self, extracts, me=None):
+        self.assignee = "@" + me.lower() if me else None
+        # Per-document positions of the key and summary ends
+        self.key_end = array('I')
+        self.summary_end = array('I')
+        self.updated = array('d')
+        self.assigned = array('b')
+        self.oldest = None
+        self.newest = None
+        self.extend(0, extracts)
+
+    def extend(self, first, extracts):
+        "Add extracts of documents appended at the `first` index"
+        assert first == len(self.updated)
+        for extract in extracts:
+            key_end = extract.find(" ")
+            summary_end = extract.find(DESCRIPTION_START)
+            if summary_end == -1:
+                summary_end = extract.find(FIELDS_START)
+            self.key_end.append(key_end if key_end != -1 else len(extract))
+            self.summary_end.append(summary_end if summary_end != -1 else len(extract))
+
+            updated = 0
+            assigned = False
+            for token in extract_columns(extract):
+                if token.startswith("upd="):
+                    updated = float(token[4:])
+            for token in extract_fields(extract):
+                if token.lower() == self.assignee:
+                    assigned = True
+            self.updated.append(updated)
+            self.assigned.append(assigned)
+            if self.oldest is None or updated < self.oldest:
+                self.oldest = updated
+            if self.newest is None or updated > self.newest:
+                self.newest = updated
+
+    def score(self, idx, terms, corpus, oldest, span):
+        "Score of a single document"
+        score = self.RECENCY * (self.updated[idx] - oldest) / span
+        if self.assigned[idx]:
+            score += self.ASSIGNED
+        for term in terms:
+            pos = corpus.find(idx, term, term != term.lower())
+            if pos == -1:
+                continue
+            if pos < self.key_end[idx]:
+                score += self.KEY
+            elif pos < self.summary_end[idx]:
+                score += self.SUMMARY
+        return score
+
+    def rank(self, indices, terms, corpus):
+        """
+        Rank results of a query.
+
+        Args:
+          indices: matching documents
+          terms: positive free text terms of the query
+          corpus: searched Corpus
+        """
+        if self.updated:
+            oldest = self.oldest
+            span = (self.newest - oldest) or 1
+        else:
+            oldest, span = 0, 1
+
+        def key(idx):
+            return -self.score(idx, terms, corpus, oldest, span)
+        return RankedResults(indices, key)
+
+
+class RankedResults:
+    """
+    Results ordered lazily: the top is selected with a bounded heap and grown
+    in doubling steps when more is requested.
+
+    Ties keep the original order of the results.
+    """
+
+    def __init__(self, indices, key):
+        self.indices = indices
+        self.key = key
+        self.query = None
+        self._top = []
+
+    def __len__(self):
+        return len(self.indices)
+
+    def top(self, count):
+        "Indices of the best `count` results"
+        count = min(count, len(self.indices))
+        if count > len(self._top):
+            size = min(max(count, 2 * len(self._top)), len(self.indices))
+            self._top = heapq.nsmallest(size, self.indices, key=self.key)
+        return self._top[:count]
@@ -0,0 +1,101 @@
+"""
+Optional index engines narrowing the candidates of the incremental search.
+
+Engines never decide about a match by themselves - they return a superset of
+matching documents, which is then verified by a substring check.
+"""
+from array import array
+
+
+class TrigramIndex:
+    """
+    Inverted index of character trigrams in the document extracts.
+
+    A document containing a term contains all of the term trigrams, so an
+    intersection of trigram posting lists is a superset of the results.
+    Terms shorter than 3 characters can't be narrowed.
+
+    Args:
+      extracts: list of searched texts
+      case_sensitive: build a second, case-sensitive variant of the index
+    """
+
+    N = 3
+
+    def __init__(self, extracts, case_sensitive=True):
+        self.insensitive = self._build(extract.lower() for extract in extracts)
+        if case_sensitive:
+            self.sensitive = self._build(extracts)
+        else:
+            self.sensitive = None
+
+    @classmethod
+    def _ngrams(cls, text):
+        "Set of unique n-grams of text"
+        return set(zip(*(text[i:] for i in range(cls.N))))
+
+    @classmethod
+    def _build(cls, texts, postings=None, first=0):
+        if postings is None:
+            postings = {}
+        for idx, text in enumerate(texts, first):
+            for gram in cls._ngrams(text):
+                try:
+                    postings[gram].append(idx)
+                except KeyError:
+                    postings[gram] = array('I', [idx])
+        return postings
+
+    def extend(self, first, extracts):
+        """
+        Index extracts of documents appended at the `first` index.
+
+        Postings of removed documents are kept - the index returns a superset
+        anyway.
+        """
+        self._build((extract.lower() for extract in extracts),
+                    self.insensitive, first)
+        if self.sensitive is not None:
+            self._build(extracts, self.sensitive, first)
+
+    def candidates(self, term, sensitive):
+        """
+        Find superset of documents containing the term.
+
+        Returns:
+          set of document indices or None when the term can't be narrowed.
+        """
+        if sensitive and self.sensitive is not None:
+            postings = self.sensitive
+        else:
+            # Lowercase match is necessary for the case-sensitive one too.
+            postings = self.insensitive
+            term = term.lower()
+
+        grams = self._ngrams(term)
+        if not grams:
+            return None
+
+        lists = []
+        for gram in grams:
+            posting = postings.get(gram)
+            if posting is None:
+                return set()
+            lists.append(posting)
+
+        # Intersect starting with the rarest trigram
+        lists.sort(key=len)
+        found = set(lists[0])
+        for posting in lists[1:]:
+            found.intersection_update(posting)
+            if not found:
+                break
+        return found
+
+    def memory_usage(self):
+        "Approximate size of the posting lists in bytes"
+        size = 0
+        for postings in (self.insensitive, self.sensitive or {}):
+            size += sum(posting.itemsize * len(posting)
+                        for posting in postings.values())
+        return size
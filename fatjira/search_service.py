@@ -0,0 +1,174 @@
+"""
+Search over all cached issues shared by the views of the application.
+"""
+import threading
+from functools import partial
+from time import time
+
+from fatjira import log
+from fatjira.incremental_search import IncrementalSearch
+from fatjira.column_index import ColumnIndex
+from fatjira.field_index import CombinedIndex, FieldIndex
+from fatjira.ranking import Ranker
+from fatjira.search_index import TrigramIndex
+from fatjira.search_worker import SearchWorker
+from fatjira.sharded_search import ShardedSearch
+
+ENGINES = {
+    None: None,
+    'trigram': TrigramIndex,
+}
+
+# Exact field filters and range filters over the sorted columns.
+FILTERS = partial(CombinedIndex, indexes=(FieldIndex, ColumnIndex))
+
+
+class SearchService:
+    """
+    Corpus and indexes of the cached issues, loaded once - optionally in
+    a background thread at start-up - and shared by all search views.
+
+    Issues stored by a sync of this process are added through the cache
+    change events. Changes made otherwise, eg. by `--update` in another
+    process, are noticed by the cache generation and applied incrementally
+    when the search is acquired.
+
+    Args:
+      jira: ServiceJira with the issue cache
+      config: SEARCH configuration
+      me: user whose issues are ranked higher
+    """
+
+    def __init__(self, jira, config=None, me=None):
+        self.jira = jira
+        self.config = config or {}
+        self.me = me
+
+        self.search = None
+        self.worker = None
+        # Cache generation the search reflects
+        self.generation = None
+        # Time in seconds it took to load the search
+        self.took = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        "Load the search in a background thread"
+        with self._lock:
+            if self._thread is None and self.worker is None:
+                self._thread = threading.Thread(target=self._load, name="search-load",
+                                                daemon=True)
+                self._thread.start()
+
+    def is_loading(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def acquire(self, wait=True):
+        """
+        Search worker over the current issues, loaded on the first use.
+
+        Returns:
+          SearchWorker, or None while loading in the background unless
+          waiting.
+        """
+        if self.is_loading():
+            if not wait:
+                return None
+            self._thread.join()
+        if self.worker is None:
+            self._load()
+        else:
+            self._refresh()
+        return self.worker
+
+    def _load(self):
+        start = time()
+        cache = self.jira.cache
+        generation = cache.get_status()['generation']
+        # Issues are searched by persisted extracts; raws are read only when
+        # displayed.
+        keys, extracts = self.jira.cached_extracts()
+        engine = ENGINES[self.config.get('engine')]
+        processes = self.config.get('processes', 1)
+        ranker = None
+        if self.config.get('ranking', False):
+            ranker = partial(Ranker, me=self.me)
+        term_cache_memory = 32 * 2**20
+        if cache.memory_budget:
+            term_cache_memory = cache.memory_budget * 2**20 // 4
+        if processes > 1:
+            search = ShardedSearch(keys, extracts, shards=processes,
+                                   engine=engine, fields=FILTERS)
+        else:
+            search = IncrementalSearch(keys, extracts=extracts,
+                                       engine=engine, fields=FILTERS,
+                                       ranker=ranker,
+                                       term_cache_memory=term_cache_memory)
+            # Queries used in the previous sessions answer instantly.
+            search.import_history(cache.load_query_cache())
+        # Search in background so the typing never lags. Search is owned by
+        # the worker thread, which also publishes the match positions and
+        # its memory usage.
+        single = isinstance(search, IncrementalSearch)
+        worker = SearchWorker(search, limit=100, highlight=single, measure=single)
+        # Issues synchronized while the app runs are added to the search.
+        if not isinstance(search, ShardedSearch):
+            cache.subscribe(self._on_change)
+
+        with self._lock:
+            self.search = search
+            self.worker = worker
+            self.generation = generation
+        self.took = time() - start
+        log.info("Search of %d issues loaded in %.2fs", len(keys), self.took)
+
+    def _on_change(self, changed, generation):
+        "Apply issues committed by a sync - called from the sync thread"
+        self.worker.update_documents(changed)
+        # Changes committed meanwhile by another process are left for the
+        # refresh.
+        if generation == self.generation + 1:
+            self.generation = generation
+
+    def _refresh(self):
+        "Apply changes of the cache not delivered by the change events"
+        if self.jira.cache.get_status()['generation'] == self.generation:
+            return
+        log.info("Issue cache changed, refreshing the search")
+        if isinstance(self.search, ShardedSearch):
+            self.close()
+            self._load()
+            return
+        self.generation = self.jira.cache.get_status()['generation']
+        keys, extracts = self.jira.cached_extracts()
+        # Unchanged issues are skipped by the search
+        self.worker.update_documents(dict(zip(keys, extracts)))
+
+    def memory_usage(self):
+        "Estimated memory of the search state and the decoded issues in bytes"
+        usage = {}
+        if self.worker is not None:
+            # Measured by the worker after the last query
+            usage.update(self.worker.memory)
+        usage.update(self.jira.cache.memory_usage())
+        return usage
+
+    def close(self):
+        "Stop the search, persisting the history of queries"
+        if self._thread is not None:
+            self._thread.join()
+        if self.worker is None:
+            return
+        self.worker.stop(timeout=1)
+        if isinstance(self.search, ShardedSearch):
+            self.search.close()
+        else:
+            self.jira.cache.unsubscribe(self._on_change)
+            # Results are valid for the next session only if they reflect
+            # the current cache - changes by other processes aren't applied.
+            if not self.worker.has_pending_updates():
+                self.jira.cache.save_query_cache(self.search.export_history(),
+                                                 self.generation)
+        self.search = None
+        self.worker = None
@@ -0,0 +1,177 @@
+"""
+Run the incremental search in background without blocking the UI.
+"""
+import threading
+
+from fatjira import log
+
+
+class SearchWorker:
+    """
+    Execute queries of IncrementalSearch in a separate thread.
+
+    Only the newest query is executed - a query submitted while the previous
+    one is running cancels it. Partial results are published as soon as the
+    first `partial_size` matches are found.
+
+    Only the first `limit` results are published; `found` is the number of
+    all of them.
+
+    Search object is owned by the worker thread; use only the published
+    `results`, `results_query`, `found`, `total`, `busy`, `positions` and
+    `memory` attributes.
+
+    Args:
+      highlight: publish match positions of the results, see
+        IncrementalSearch.match_positions
+      measure: publish memory usage of the search after each query
+    """
+
+    def __init__(self, search, partial_size=100, limit=2**32, highlight=False,
+                 measure=False):
+        self.search = search
+        self.partial_size = partial_size
+        self.limit = limit
+        self.highlight = highlight
+        self.measure = measure
+
+        self._cond = threading.Condition()
+        self._query = None
+        # Document updates waiting to be applied by the worker thread
+        self._updates = []
+        # Incremented on each submitted query or update
+        self._generation = 0
+        self._stop = False
+        # Set when new results were published and not yet polled
+        self._fresh = False
+
+        # Published state
+        self.results = list(search.get_results(limit))
+        self.results_query = search.query
+        self.found = len(search.current_results)
+        self.total = len(search.documents)
+        self.busy = False
+        # {document: sorted match positions in its head} of the results
+        self.positions = self._positions(self.results)
+        # Memory usage breakdown of the search in bytes
+        self.memory = search.memory_usage() if measure else {}
+
+        self._thread = threading.Thread(target=self._run, name="search",
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, query):
+        "Schedule a query, cancelling the one in progress"
+        with self._cond:
+            if query == self._query:
+                return
+            self._query = query
+            self._generation += 1
+            self.busy = True
+            self._cond.notify()
+
+    def more(self, limit):
+        "Publish more results of the current query"
+        with self._cond:
+            if limit <= self.limit:
+                return
+            self.limit = limit
+            self._generation += 1
+            self.busy = True
+            self._cond.notify()
+
+    def update_documents(self, changed=None, removed=()):
+        """
+        Schedule an update of the searched documents, see
+        IncrementalSearch.update_documents. Current query is searched again
+        afterwards. Can be called from any thread.
+        """
+        with self._cond:
+            self._updates.append((changed, removed))
+            self._generation += 1
+            self.busy = True
+            self._cond.notify()
+
+    def poll(self):
+        "Returns True once after each publication of new results"
+        with self._cond:
+            fresh, self._fresh = self._fresh, False
+            return fresh
+
+    def stop(self, timeout=None):
+        "Stop the worker; wait up to timeout seconds for it to finish"
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if timeout is not None:
+            self._thread.join(timeout)
+
+    def has_pending_updates(self):
+        "Some document updates were not applied to the search"
+        with self._cond:
+            return bool(self._updates) or self._thread.is_alive()
+
+    def _positions(self, results):
+        "Match positions of the results - called by the worker thread"
+        if not self.highlight:
+            return {}
+        return {document: self.search.match_positions(document)[1]
+                for document in results}
+
+    def _publish(self, generation, query, results, found, done):
+        positions = self._positions(results)
+        memory = self.search.memory_usage() if done and self.measure else None
+        with self._cond:
+            if generation != self._generation:
+                # Stale query
+                return
+            self.results = results
+            self.positions = positions
+            if memory is not None:
+                self.memory = memory
+            self.found = found
+            self.results_query = query
+            if done:
+                self.busy = False
+            self._fresh = True
+
+    def _run(self):
+        handled = 0
+        while True:
+            with self._cond:
+                while not self._stop and self._generation == handled:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                handled = generation = self._generation
+                query = self._query
+                updates, self._updates = self._updates, []
+
+            for changed, removed in updates:
+                self.search.update_documents(changed, removed)
+            if updates:
+                self.total = self.search.count()
+            if query is None:
+                query = self.search.query
+
+            def cancel():
+                return self._stop or self._generation != generation
+
+            def on_partial(indices):
+                results = [self.search.documents[idx] for idx in indices]
+                self._publish(generation, query, results, len(results), done=False)
+
+            try:
+                done = self.search.search(query, cancel=cancel,
+                                          on_partial=on_partial,
+                                          partial_size=self.partial_size)
+            except Exception:
+                log.exception("Search for %r failed", query)
+                done = False
+                with self._cond:
+                    if generation == self._generation:
+                        self.busy = False
+            if done:
+                results = self.search.get_results(self.limit)
+                self._publish(generation, query, results,
+                              len(self.search.current_results), done=True)
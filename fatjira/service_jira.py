@@ -6,6 +6,7 @@ import getpass
 from jira import JIRA, Issue, JIRAError
 
 from fatjira import IssueCache
+from fatjira.search_service import SearchService
 
 
 class ServiceJira:
@@ -16,11 +17,13 @@ class ServiceJira:
     - will use the API of the external Jira module.
     """
 
-    def __init__(self, server_config, issue_config):
+    def __init__(self, server_config, issue_config, search_config=None):
         # Link/connection to Jira.
         self.link = None
         self.server_config = server_config
         self.cache = IssueCache(issue_config, self)
+        # Search over the cached issues shared by the views.
+        self.search = SearchService(self, search_config, me=server_config['usr'])
 
     def connect(self):
         # TODO: Parallelize
@@ -49,6 +52,23 @@ class ServiceJira:
     def is_connected(self):
         return self.link is not None
 
+    def worklogs_updated(self, since):
+        """
+        Single page of IDs of worklogs updated since a timestamp (in ms).
+
+        Returns the raw API response with `values`, `until` and `lastPage`.
+        """
+        return self.link._get_json('worklog/updated', params={'since': since})
+
+    def worklogs_deleted(self, since):
+        "Single page of IDs of worklogs deleted since a timestamp (in ms)"
+        return self.link._get_json('worklog/deleted', params={'since': since})
+
+    def worklogs_list(self, ids):
+        "Read up to 1000 worklogs by IDs"
+        return self.link._get_json('worklog/list', params={'ids': ids},
+                                   use_post=True)
+
     def all_cached_issues(self):
         """
         Return list of all cached issues. Without refreshing.
@@ -57,12 +77,28 @@ class ServiceJira:
         class. This takes 3x the time than working on raw dicts. Any code using
         raws can easily work on a raw - except for updates.
         """
+        issues = self.cache.load_snapshot()
+        if issues is not None:
+            return issues
         issues = [
-            self.cache.get_raw(key)
-            for key in self.cache.issue_list()
+            raw
+            for key, raw in self.cache.storage.items()
         ]
         return issues
 
+    def cached_extracts(self):
+        """
+        Keys and search extracts of all cached issues.
+
+        Reading extracts is much cheaper than reading issues - use them to
+        search and read raws only for the displayed issues.
+        """
+        return self.cache.load_extracts()
+
+    def close(self):
+        "Stop background work before exiting"
+        self.search.close()
+
     def get_issue(self, key, refresh=True):
         """
         Get a potentially cached issue. Keep Jira module API.
@@ -71,7 +107,7 @@ class ServiceJira:
         This returns a wrapped issue for detailed work on a single issue.
         """
         assert not key.startswith("_")
-        cached = self.cache.shelve.get(key, None)
+        cached = self.cache.get_raw(key)
         if cached is None and (refresh is False or self.jira.is_connected is False):
             return None
 
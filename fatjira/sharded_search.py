@@ -0,0 +1,153 @@
+"""
+Incremental search split across worker processes to use multiple cores.
+"""
+import os
+import multiprocessing
+
+from fatjira import IncrementalSearch
+
+
+def _shard_main(conn, extracts, engine, fields, generation):
+    """
+    Worker process: search within a single shard of extracts.
+
+    Keeps its own IncrementalSearch - with its own prefix cache. Field
+    values are exchanged with the other shards through the parent first.
+    """
+    search = IncrementalSearch(range(len(extracts)), extracts=extracts,
+                               engine=engine, fields=fields)
+    if search.fields is not None:
+        conn.send(search.fields.indexed_values())
+        search.fields.share_values(conn.recv())
+    while True:
+        request = conn.recv()
+        if request is None:
+            return
+        query_generation, query = request
+
+        def cancel():
+            return generation.value != query_generation
+
+        if search.search(query, cancel=cancel):
+            conn.send((query_generation, list(search.current_results)))
+        else:
+            conn.send((query_generation, None))
+
+
+class ShardedSearch:
+    """
+    IncrementalSearch-compatible search over extracts partitioned into
+    contiguous shards, each searched by a separate process.
+
+    Shard results are ordered, so merging them in the shard order keeps the
+    ordering of a single-process search.
+
+    Args:
+      documents: list of searched documents (or their keys)
+      extracts: extracted texts of the documents
+      shards: number of worker processes, by default number of CPUs
+      engine: index engine factory used by each shard
+      fields: field index factory used by each shard
+    """
+
+    def __init__(self, documents, extracts, shards=None, engine=None, fields=None):
+        assert len(extracts) == len(documents)
+        self.query = ""
+        self.documents = documents
+        self.current_results = list(range(len(documents)))
+        self.fields = fields
+
+        shards = max(1, min(shards or os.cpu_count() or 1, len(documents) or 1))
+        size = -(-len(documents) // shards)
+        self.offsets = list(range(0, len(documents), size)) or [0]
+
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:
+            context = multiprocessing.get_context()
+
+        # Generation of the current query, shared with the workers to cancel
+        # stale queries early.
+        self._generation = context.Value('L', 0, lock=False)
+        self._connections = []
+        self._processes = []
+        for offset in self.offsets:
+            parent, child = context.Pipe()
+            process = context.Process(
+                target=_shard_main,
+                args=(child, extracts[offset:offset + size], engine, fields,
+                      self._generation),
+                daemon=True
+            )
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+
+        # Whether a filter value is complete or still typed is decided by
+        # the values of all shards - as in a single-process search.
+        if fields is not None:
+            shard_values = [conn.recv() for conn in self._connections]
+            for conn in self._connections:
+                conn.send(shard_values)
+
+    def get_normalized_query(self):
+        search = IncrementalSearch([], extracts=[], fields=self.fields)
+        search.query = self.query
+        return search.get_normalized_query()
+
+    def get_results(self, max_results=2**32):
+        return [
+            self.documents[idx]
+            for idx in self.current_results[:max_results]
+        ]
+
+    def _receive(self, shard, generation, cancel):
+        """
+        Wait for the shard response to a given query generation. Responses to
+        the previously cancelled queries are skipped.
+        """
+        conn = self._connections[shard]
+        while True:
+            while cancel is None or not cancel():
+                if conn.poll(0.05):
+                    break
+            else:
+                return None
+            response_generation, results = conn.recv()
+            if response_generation == generation:
+                return results
+
+    def search(self, new_query, cancel=None, on_partial=None, partial_size=100):
+        "Fan out the query to the shards and merge the results"
+        self.query = new_query
+        self._generation.value += 1
+        generation = self._generation.value
+        for conn in self._connections:
+            conn.send((generation, new_query))
+
+        merged = []
+        reported = False
+        for shard, offset in enumerate(self.offsets):
+            results = self._receive(shard, generation, cancel)
+            if results is None:
+                return False
+            merged.extend(offset + idx for idx in results)
+            if on_partial is not None and not reported and len(merged) >= partial_size:
+                on_partial(merged[:partial_size])
+                reported = True
+
+        self.current_results = merged
+        return True
+
+    def close(self):
+        "Stop worker processes"
+        for conn in self._connections:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,464 @@
+"""
+Storage backends for the local issue cache.
+
+Issues are kept as raw Jira dictionaries keyed by the issue key. Additional
+records (field mapping, synchronization status) are kept separately as "meta"
+records so they never mix with issue keys.
+"""
+import base64
+import json
+import lzma
+import shelve
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class Codec:
+    """
+    Optional compression of stored issues.
+
+    Jira JSON is highly repetitive across issues, so zlib can be primed with
+    a shared dictionary built from sample issues. Compressed blobs are tagged
+    with a method, so issues stored with other settings remain readable.
+
+    Args:
+      method: None, 'zlib' or 'lzma'
+      level: compression level
+      use_dict: prime zlib with a shared dictionary
+    """
+
+    ZDICT_SIZE = 32 * 1024
+    # Issues needed to build the dictionary - it's persisted for good, so
+    # it must represent more than a few issues.
+    TRAIN_SAMPLE = 100
+
+    def __init__(self, method=None, level=6, use_dict=True):
+        if method not in (None, 'zlib', 'lzma'):
+            raise Exception(f"Unknown compression {method}, use zlib or lzma")
+        self.method = method
+        self.level = level
+        self.use_dict = use_dict and method == 'zlib'
+        self.zdict = None
+
+    def needs_training(self):
+        return self.use_dict and self.zdict is None
+
+    def train(self, raws):
+        """
+        Build a dictionary from sample issues. zlib prefers the most common
+        strings at the end of the dictionary.
+        """
+        sample = "".join(self._dumps(raw) for raw in raws)
+        self.zdict = sample.encode('utf-8')[-self.ZDICT_SIZE:]
+
+    @staticmethod
+    def _dumps(raw):
+        "Serialize the same way for the dictionary and the blobs"
+        return json.dumps(raw, sort_keys=True)
+
+    def encode(self, raw):
+        "Encode raw issue into a storable value"
+        if self.method is None:
+            return raw
+        data = self._dumps(raw).encode('utf-8')
+        if self.method == 'lzma':
+            return b'x' + lzma.compress(data, preset=self.level)
+        if self.zdict is not None:
+            compressor = zlib.compressobj(self.level, zdict=self.zdict)
+            return b'd' + compressor.compress(data) + compressor.flush()
+        return b'z' + zlib.compress(data, self.level)
+
+    def decode(self, value):
+        "Decode a stored value. Non-binary values were stored uncompressed."
+        if not isinstance(value, bytes):
+            return value
+        tag, data = value[:1], value[1:]
+        if tag == b'd':
+            if self.zdict is None:
+                raise Exception("Compression dictionary is missing - recreate DB")
+            decompressor = zlib.decompressobj(zdict=self.zdict)
+            data = decompressor.decompress(data) + decompressor.flush()
+        elif tag == b'z':
+            data = zlib.decompress(data)
+        elif tag == b'x':
+            data = lzma.decompress(data)
+        else:
+            raise Exception(f"Unknown blob format {tag}")
+        return json.loads(data)
+
+
+class Storage:
+    """
+    Interface of the IssueCache storage.
+
+    Backends are expected to be safe to use from multiple threads.
+    """
+
+    def _load_codec(self, codec):
+        "Install a codec and its dictionary persisted with the data"
+        self.codec = codec or Codec()
+        zdict = self.get_meta('compression_dict')
+        if zdict is not None:
+            self.codec.zdict = base64.b64decode(zdict)
+
+    def prime(self, raws):
+        """
+        Train and persist the compression dictionary on a batch of issues,
+        completed by the stored ones. Committed separately, before any blob
+        depends on it.
+
+        Until there are TRAIN_SAMPLE issues, they are compressed without
+        the dictionary.
+        """
+        if not self.codec.needs_training() or not raws:
+            return
+        needed = self.codec.TRAIN_SAMPLE
+        sample = list(raws[:needed])
+        if len(sample) < needed:
+            stored = self.keys()[:needed - len(sample)]
+            sample += [raw for _, raw in self.items(stored)]
+        if len(sample) < needed:
+            return
+        with self.transaction():
+            self.codec.train(sample)
+            self.put_meta('compression_dict',
+                          base64.b64encode(self.codec.zdict).decode('ascii'))
+
+    def get(self, key):
+        "Return a raw issue or None"
+        raise NotImplementedError
+
+    def put(self, key, raw, extract=None):
+        "Insert or replace a raw issue along with its search extract"
+        raise NotImplementedError
+
+    def put_extract(self, key, extract):
+        "Replace the search extract of a stored issue, keeping the issue"
+        raise NotImplementedError
+
+    def extracts(self):
+        "List (key, extract) pairs of all issues; extract can be None"
+        raise NotImplementedError
+
+    def keys(self):
+        "List keys of all stored issues"
+        raise NotImplementedError
+
+    def items(self, keys=None):
+        "Iterate over (key, raw) pairs - all of them or only for given keys"
+        if keys is None:
+            keys = self.keys()
+        for key in keys:
+            raw = self.get(key)
+            if raw is not None:
+                yield key, raw
+
+    def keys_for_ids(self, issue_ids):
+        "Map numeric Jira issue IDs into keys of the stored issues"
+        issue_ids = set(issue_ids)
+        if not issue_ids:
+            return {}
+        return {
+            raw['id']: key
+            for key, raw in self.items()
+            if raw.get('id') in issue_ids
+        }
+
+    def get_meta(self, name, default=None):
+        "Read a non-issue record, like a status or a field mapping"
+        raise NotImplementedError
+
+    def put_meta(self, name, value):
+        raise NotImplementedError
+
+    def sync(self):
+        "Flush data to disc"
+        raise NotImplementedError
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group writes into a single batch flushed at the end.
+
+        Backends supporting transactions apply all writes atomically.
+        """
+        with self.lock:
+            yield self
+            self.sync()
+
+    def close(self):
+        raise NotImplementedError
+
+
+class ShelveStorage(Storage):
+    """
+    Legacy storage using a pickled shelve. Slow to read en masse.
+
+    Transactions are not atomic - writes are only flushed together.
+
+    Meta records are stored under keys starting with "_", including the
+    map of Jira issue IDs to keys.
+    """
+
+    def __init__(self, path, codec=None):
+        # Shelve will append ".db"
+        self.shelve = shelve.open(path)
+        self.lock = threading.RLock()
+        self._load_codec(codec)
+
+    def get(self, key):
+        with self.lock:
+            value = self.shelve.get(key, None)
+        return self.codec.decode(value)
+
+    def put(self, key, raw, extract=None):
+        value = self.codec.encode(raw)
+        with self.lock:
+            self.shelve[key] = value
+            self.shelve["_extract:" + key] = extract
+            if raw.get('id') is not None:
+                self.shelve["_id:" + raw['id']] = key
+
+    def put_extract(self, key, extract):
+        with self.lock:
+            self.shelve["_extract:" + key] = extract
+
+    def extracts(self):
+        with self.lock:
+            return [
+                (key, self.shelve.get("_extract:" + key))
+                for key in self.keys()
+            ]
+
+    def keys(self):
+        with self.lock:
+            return [
+                key
+                for key in self.shelve.keys()
+                if not key.startswith("_")
+            ]
+
+    def keys_for_ids(self, issue_ids):
+        with self.lock:
+            if not self.shelve.get("_id_map", False):
+                # Caches written before the map are scanned once.
+                for key, raw in self.items():
+                    if raw.get('id') is not None:
+                        self.shelve["_id:" + raw['id']] = key
+                self.shelve["_id_map"] = True
+            found = {
+                issue_id: self.shelve.get("_id:" + issue_id)
+                for issue_id in set(issue_ids)
+            }
+        return {
+            issue_id: key
+            for issue_id, key in found.items()
+            if key is not None
+        }
+
+    def get_meta(self, name, default=None):
+        with self.lock:
+            return self.shelve.get("_" + name, default)
+
+    def put_meta(self, name, value):
+        with self.lock:
+            self.shelve["_" + name] = value
+
+    def sync(self):
+        with self.lock:
+            self.shelve.sync()
+
+    def close(self):
+        with self.lock:
+            self.shelve.close()
+
+
+class SqliteStorage(Storage):
+    """
+    SQLite storage in WAL mode. Issues are stored as JSON (or compressed
+    blobs) along indexed columns, so the subsets can be queried without
+    decoding all issues.
+    """
+
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS issues (
+            key TEXT PRIMARY KEY,
+            id TEXT,
+            updated REAL,
+            raw TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS issues_id ON issues (id)",
+        "CREATE INDEX IF NOT EXISTS issues_updated ON issues (updated)",
+        # Kept apart from the large issue rows to be read quickly.
+        """
+        CREATE TABLE IF NOT EXISTS extracts (
+            key TEXT PRIMARY KEY,
+            extract TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS meta (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """,
+    ]
+
+    def __init__(self, path, codec=None):
+        self.path = path + ".sqlite"
+        # Connection is shared by threads, serialized with the lock.
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.RLock()
+        with self.lock:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.SCHEMA:
+                self.db.execute(statement)
+            self.db.commit()
+        self._load_codec(codec)
+
+    def _encode(self, raw):
+        value = self.codec.encode(raw)
+        if isinstance(value, bytes):
+            return value
+        return json.dumps(value)
+
+    def _decode(self, value):
+        if isinstance(value, bytes):
+            return self.codec.decode(value)
+        return json.loads(value)
+
+    @staticmethod
+    def _updated(raw):
+        "Extract update timestamp for the indexed column"
+        try:
+            updated = raw['fields']['updated']
+            return datetime.strptime(updated, '%Y-%m-%dT%H:%M:%S.000%z').timestamp()
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT raw FROM issues WHERE key = ?",
+                                  (key,)).fetchone()
+        if row is None:
+            return None
+        return self._decode(row[0])
+
+    def put(self, key, raw, extract=None):
+        value = self._encode(raw)
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO issues (key, id, updated, raw) "
+                "VALUES (?, ?, ?, ?)",
+                (key, raw.get('id'), self._updated(raw), value)
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO extracts (key, extract) VALUES (?, ?)",
+                (key, extract)
+            )
+
+    def put_extract(self, key, extract):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO extracts (key, extract) VALUES (?, ?)",
+                (key, extract)
+            )
+
+    def extracts(self):
+        "Read extracts without touching the issue bodies"
+        with self.lock:
+            return self.db.execute(
+                "SELECT issues.key, extract FROM issues "
+                "LEFT JOIN extracts ON issues.key = extracts.key"
+            ).fetchall()
+
+    def keys(self):
+        with self.lock:
+            rows = self.db.execute("SELECT key FROM issues").fetchall()
+        return [row[0] for row in rows]
+
+    def items(self, keys=None):
+        with self.lock:
+            if keys is None:
+                rows = self.db.execute("SELECT key, raw FROM issues").fetchall()
+            else:
+                rows = []
+                keys = list(keys)
+                # Stay below the SQLite variable limit
+                for i in range(0, len(keys), 500):
+                    chunk = keys[i:i + 500]
+                    marks = ",".join("?" * len(chunk))
+                    rows += self.db.execute(
+                        f"SELECT key, raw FROM issues WHERE key IN ({marks})",
+                        chunk
+                    ).fetchall()
+        for key, raw in rows:
+            yield key, self._decode(raw)
+
+    def keys_for_ids(self, issue_ids):
+        issue_ids = list(issue_ids)
+        rows = []
+        with self.lock:
+            for i in range(0, len(issue_ids), 500):
+                chunk = issue_ids[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                rows += self.db.execute(
+                    f"SELECT id, key FROM issues WHERE id IN ({marks})", chunk
+                ).fetchall()
+        return dict(rows)
+
+    def get_meta(self, name, default=None):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE name = ?",
+                                  (name,)).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def put_meta(self, name, value):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                (name, json.dumps(value))
+            )
+
+    def sync(self):
+        with self.lock:
+            self.db.commit()
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            try:
+                yield self
+            except BaseException:
+                self.db.rollback()
+                raise
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+BACKENDS = {
+    'shelve': ShelveStorage,
+    'sqlite': SqliteStorage,
+}
+
+
+def open_storage(backend, path, codec=None):
+    "Open storage by a backend name from the config"
+    try:
+        backend_cls = BACKENDS[backend]
+    except KeyError:
+        raise Exception(f"Unknown cache backend {backend}, use one of: "
+                        f"{', '.join(BACKENDS)}")
+    return backend_cls(path, codec)
@@ -0,0 +1,64 @@
+import pytest
+
+from fatjira.extract import (
+    compile_spec, build_extracts, spec_version, extract_issue, extract_fields,
+    extract_columns, DEFAULT_SPEC, EXTRACT_VERSION, DESCRIPTION_START, FIELDS_START,
+)
+
+ISSUE = {
+    "key": "EXT-1",
+    "fields": {
+        "summary": "Fix the cooler",
+        "description": None,
+        "assignee": None,
+        "reporter": {"name": "bob"},
+        "status": {"name": "In Progress"},
+        "issuetype": {"name": "Bug"},
+        "project": {"key": "EXT"},
+        "labels": ["ops", "beer"],
+        "components": [{"name": "Back end"}, {"name": "UI"}],
+        "updated": "2020-10-01T10:00:00.000+0000",
+        "timespent": 3600,
+    }
+}
+
+
+def test_default_spec():
+    extract = extract_issue(ISSUE)
+    assert extract.startswith("EXT-1 Fix the cooler " + DESCRIPTION_START + " " + FIELDS_START)
+    assert extract_fields(extract) == [
+        "k=EXT-1", "@none", "rep=bob", "st=INPROGRESS", "t=Bug", "p=EXT",
+        "l=ops", "l=beer", "c=Back end", "c=UI",
+    ]
+    assert extract_columns(extract) == ["upd=1601546400", "spent=3600"]
+
+
+def test_custom_spec():
+    spec = {
+        'text': [{'path': 'fields.summary'}, {'path': 'fields.labels[]', 'prefix': '#'}],
+        'fields': [
+            {'path': 'fields.timespent', 'prefix': 'spent='},
+            {'path': 'fields.missing.deep', 'prefix': 'm=', 'default': '-'},
+            {'path': 'fields.components[].name', 'prefix': 'c='},
+            {'path': 'fields.nothing[]', 'prefix': 'n='},
+        ],
+    }
+    extract = compile_spec(spec)(ISSUE)
+    assert extract == "Fix the cooler #ops beer " + FIELDS_START + "\x1f".join(
+        ["spent=3600", "m=-", "c=Back end", "c=UI"])
+    assert spec_version(spec) != EXTRACT_VERSION
+    assert spec_version(DEFAULT_SPEC) == EXTRACT_VERSION
+
+    with pytest.raises(Exception):
+        compile_spec({'fields': [{'path': 'key', 'transform': 'unknown'}]})
+
+
+def test_parallel_build():
+    "Chunks extracted on a process pool keep the order"
+    issues = []
+    for i in range(50):
+        issue = dict(ISSUE, key="EXT-%d" % i)
+        issues.append(issue)
+    serial = build_extracts(issues)
+    assert serial == [extract_issue(issue) for issue in issues]
+    assert build_extracts(issues, processes=3, chunk_size=7) == serial
@@ -0,0 +1,500 @@
+import re
+from datetime import datetime
+
+import pytest
+from jira import Issue
+
+from fatjira import IssueCache
+from fatjira.extract import extract_issue, EXTRACT_VERSION
+from fatjira.storage import Codec
+
+
+def make_raw(key, updated, summary="Summary", timespent=None):
+    return {
+        "id": str(abs(hash(key)) % 100000),
+        "key": key,
+        "fields": {
+            "summary": summary,
+            "description": None,
+            "updated": updated,
+            "timespent": timespent,
+            "assignee": None,
+            "reporter": {"name": "reporter"},
+            "status": {"name": "Open"},
+            "issuetype": {"name": "Task"},
+        }
+    }
+
+
+class FakeLink:
+    "Minimal imitation of the jira.JIRA connection"
+
+    def __init__(self, raws):
+        self.raws = raws
+        self.searches = 0
+        self.worklog_reads = []
+
+    def fields(self):
+        return [{"id": "summary", "name": "Summary"}]
+
+    def search_issues(self, query, maxResults, startAt, fields):
+        self.searches += 1
+        since = re.search(r'updated >= "([^"]+)"', query).group(1)
+        since = datetime.strptime(since, "%Y-%m-%d %H:%M").timestamp()
+        project = re.search(r'project = (\w+)', query)
+        matching = [
+            raw for raw in self.raws
+            if IssueCache._parse_time(None, raw['fields']['updated']) >= since
+            if project is None or raw['key'].startswith(project.group(1) + "-")
+        ]
+        matching.sort(key=lambda raw: raw['fields']['updated'])
+        page = matching[startAt:startAt + maxResults]
+        return [Issue(options={}, session=None, raw=dict(raw)) for raw in page]
+
+    def worklogs(self, key):
+        self.worklog_reads.append(key)
+        return [
+            FakeWorklog({"id": key + "-wl", "timeSpent": "1h",
+                         "author": {"name": "worker"}})
+        ]
+
+
+class FakeWorklog:
+    def __init__(self, raw):
+        self.raw = raw
+
+
+class FakeJira:
+    "Imitation of the ServiceJira bulk worklog API"
+
+    def __init__(self, raws):
+        self.link = FakeLink(raws)
+        # (updated ms, worklog raw)
+        self.worklogs = []
+        self.deleted = []
+
+    def _page(self, entries, since):
+        values = [entry for entry in entries if entry[0] >= since]
+        until = max([entry[0] for entry in values], default=since)
+        return {'values': [{'worklogId': entry[1]['id'], 'updatedTime': entry[0]}
+                           for entry in values],
+                'until': until + 1, 'lastPage': True}
+
+    def worklogs_updated(self, since):
+        return self._page(self.worklogs, since)
+
+    def worklogs_deleted(self, since):
+        return self._page(self.deleted, since)
+
+    def worklogs_list(self, ids):
+        return [worklog for updated, worklog in self.worklogs
+                if worklog['id'] in ids]
+
+
+RAWS = [
+    make_raw("TEST-%d" % i, "2020-10-%02dT10:00:00.000+0000" % (i + 1),
+             summary="Issue number %d" % i)
+    for i in range(10)
+]
+
+
+def make_cache(tmp_path, backend, raws, **config):
+    cfg = {
+        'issue_filter': 'project in (TEST)',
+        'field_filter': None,
+        'cache_backend': backend,
+        'cache_path': str(tmp_path / "cache"),
+        'sync_since': '1970-01-01T01:00:00.000+0000',
+        'sync_worklogs': False,
+        'threads': 2,
+    }
+    cfg.update(config)
+    return IssueCache(cfg, FakeJira(raws))
+
+
+@pytest.mark.parametrize("backend", ["shelve", "sqlite"])
+class TestIssueCache:
+
+    def test_update(self, tmp_path, backend):
+        cache = make_cache(tmp_path, backend, RAWS)
+        assert cache.update()
+        assert sorted(cache.issue_list()) == sorted(raw['key'] for raw in RAWS)
+        assert cache.get_raw("TEST-3")['fields']['summary'] == "Issue number 3"
+        assert cache.get_raw("TEST-missing") is None
+
+        status = cache.get_status()
+        assert status['issues_read'] == len(RAWS)
+        assert status['last_updated'] == cache._parse_time(
+            RAWS[-1]['fields']['updated'])
+
+        cache.load_field_mapping()
+        assert cache._field_by_name == {"Summary": "summary"}
+
+    def test_reopen(self, tmp_path, backend):
+        cache = make_cache(tmp_path, backend, RAWS)
+        cache.update()
+        cache.storage.close()
+
+        cache = make_cache(tmp_path, backend, RAWS)
+        assert len(cache.issue_list()) == len(RAWS)
+        assert dict(cache.storage.items(["TEST-1"]))["TEST-1"] == RAWS[1]
+
+
+def test_interrupted_update_resumes(tmp_path):
+    "Watermark is committed atomically with the stored batch"
+    cache = make_cache(tmp_path, "sqlite", RAWS, commit_interval=3)
+    put = cache.storage.put
+    stored = []
+
+    def failing_put(key, raw, extract=None):
+        if len(stored) == 7:
+            raise IOError("Simulated crash")
+        stored.append(key)
+        put(key, raw, extract)
+    cache.storage.put = failing_put
+
+    with pytest.raises(IOError):
+        cache.update()
+
+    # Two full batches survived, the third one was rolled back.
+    status = cache.get_status()
+    assert status['issues_read'] == 6
+    assert len(cache.issue_list()) == 6
+    assert status['last_updated'] == cache._parse_time(RAWS[5]['fields']['updated'])
+
+    cache.storage.put = put
+    cache.update()
+    assert len(cache.issue_list()) == len(RAWS)
+
+
+def test_change_detection(tmp_path):
+    "Re-read unchanged issues are neither stored nor get worklogs re-read"
+    raws = [dict(raw) for raw in RAWS]
+    raws[0] = make_raw("TEST-0", raws[0]['fields']['updated'], timespent=3600)
+    raws[1] = make_raw("TEST-1", raws[1]['fields']['updated'], timespent=60)
+    cache = make_cache(tmp_path, "sqlite", raws, sync_worklogs=True)
+    link = cache.jira.link
+    cache.update()
+    assert cache.issues_new == len(raws)
+    assert sorted(link.worklog_reads) == ["TEST-0", "TEST-1"]
+    assert cache.get_raw("TEST-0")['fields']['worklog']['total'] == 1
+
+    # Summary changes, spent time doesn't: worklogs are carried over.
+    updated = "2020-11-01T10:00:00.000+0000"
+    raws[0] = make_raw("TEST-0", updated, summary="New", timespent=3600)
+    # Spent time changes: worklogs need to be read again.
+    raws[1] = make_raw("TEST-1", updated, timespent=120)
+    link.worklog_reads.clear()
+    cache.update()
+    assert link.worklog_reads == ["TEST-1"]
+    assert cache.issues_changed == 2
+    raw = cache.get_raw("TEST-0")
+    assert raw['fields']['summary'] == "New"
+    assert raw['fields']['worklog']['total'] == 1
+
+    # Only the overlap window is read again, without any changes.
+    link.worklog_reads.clear()
+    unchanged = cache.issues_unchanged
+    cache.update()
+    assert link.worklog_reads == []
+    assert cache.issues_unchanged == unchanged + 2
+    assert cache.issues_changed == 2
+
+
+def test_pipelined_update(tmp_path):
+    "Pipelined sync stores all pages in order"
+    raws = [
+        make_raw("PIPE-%d" % i, "2020-10-01T10:%02d:00.000+0000" % i, timespent=60)
+        for i in range(20)
+    ]
+    cache = make_cache(tmp_path, "sqlite", raws, sync_worklogs=True,
+                       sync_pipeline=True, commit_interval=2)
+    read_pages = cache._read_pages
+    cache._read_pages = lambda query: read_pages(query, page_size=3, pages=2)
+    cache.update()
+
+    assert sorted(cache.issue_list()) == sorted(raw['key'] for raw in raws)
+    assert sorted(cache.jira.link.worklog_reads) == sorted(cache.issue_list())
+    status = cache.get_status()
+    assert status['last_updated'] == cache._parse_time(raws[-1]['fields']['updated'])
+    assert cache.get_raw("PIPE-7")['fields']['worklog']['total'] == 1
+
+
+def test_sharded_update(tmp_path):
+    "Initial sync split into shards hands over to a single watermark"
+    raws = [
+        make_raw("%s-%d" % (project, i), "2020-10-%02dT10:00:00.000+0000" % (i + 1))
+        for project in ["A", "B"]
+        for i in range(5)
+    ]
+    cache = make_cache(tmp_path, "sqlite", raws, issue_filter="project in (A, B)",
+                       sync_shards=["project = A", "project = B"])
+    assert cache.needs_sharded_sync()
+    cache.update()
+    assert sorted(cache.issue_list()) == sorted(raw['key'] for raw in raws)
+
+    status = cache.get_status()
+    assert status['shards'] == {}
+    assert status['issues_read'] == len(raws)
+    assert status['last_updated'] == status['shards_started'] - 15 * 60
+    assert not cache.needs_sharded_sync()
+
+    # Incremental sync continues with a single query
+    searches = cache.jira.link.searches
+    cache.update()
+    assert cache.jira.link.searches == searches + 1
+
+
+WL_TS = 1601546400000
+
+
+@pytest.mark.parametrize("backend", ["shelve", "sqlite"])
+def test_bulk_worklogs(tmp_path, backend):
+    "Worklogs are merged from the bulk API instead of read per issue"
+    raws = [make_raw("TEST-%d" % i, "2020-10-01T10:0%d:00.000+0000" % i,
+                     timespent=3600)
+            for i in range(3)]
+    for raw in raws:
+        raw['fields']['created'] = raw['fields']['updated']
+    cache = make_cache(tmp_path, backend, raws, sync_worklogs='bulk')
+    jira = cache.jira
+    for i, raw in enumerate(raws):
+        jira.worklogs.append((WL_TS + i, {
+            "id": "wl-%d" % i, "issueId": raw['id'], "timeSpent": "1h",
+            "started": "2020-10-01T10:00:00.000+0000",
+        }))
+    cache.update()
+    assert jira.link.worklog_reads == []
+    assert cache.worklogs_read == 3
+    assert cache.get_raw("TEST-1")['fields']['worklog']['worklogs'][0]['id'] == "wl-1"
+    assert cache.get_status()['worklogs_since'] == WL_TS + 3
+
+    # A second worklog is added to TEST-1, worklog of TEST-2 is deleted.
+    jira.worklogs.append((WL_TS + 1000, {
+        "id": "wl-new", "issueId": raws[1]['id'], "timeSpent": "2h",
+        "started": "2020-10-02T10:00:00.000+0000",
+    }))
+    jira.deleted.append((WL_TS + 1000, {"id": "wl-2"}))
+    raws[1] = make_raw("TEST-1", "2020-10-02T10:00:00.000+0000", timespent=10800)
+    raws[2] = make_raw("TEST-2", "2020-10-02T10:00:00.000+0000", timespent=None)
+    cache.update()
+
+    worklogs = cache.get_raw("TEST-1")['fields']['worklog']['worklogs']
+    assert [worklog['id'] for worklog in worklogs] == ["wl-1", "wl-new"]
+    assert 'worklog' not in cache.get_raw("TEST-2")['fields']
+    assert cache.get_raw("TEST-0")['fields']['worklog']['total'] == 1
+
+
+def test_bulk_worklogs_of_older_issues(tmp_path):
+    "Worklogs of new issues created before the bulk watermark are read"
+    raws = [make_raw("TEST-%d" % i, "2020-10-01T10:0%d:00.000+0000" % i,
+                     timespent=3600 if i else None)
+            for i in range(3)]
+    raws[1]['fields']['created'] = "2020-09-01T10:00:00.000+0000"
+    raws[2]['fields']['created'] = "2020-10-01T09:00:00.000+0000"
+    cache = make_cache(tmp_path, "sqlite", raws, sync_worklogs='bulk',
+                       sync_since='2020-09-15T10:00:00.000+0000')
+    cache.update()
+    assert cache.jira.link.worklog_reads == ["TEST-1"]
+    assert cache.get_raw("TEST-1")['fields']['worklog']['total'] == 1
+
+
+def test_shelve_id_map(tmp_path):
+    "Shelve caches written without the ID map are indexed on the first use"
+    cache = make_cache(tmp_path, "shelve", RAWS)
+    cache.update()
+    shelf = cache.storage.shelve
+    for key in list(shelf.keys()):
+        if key.startswith("_id"):
+            del shelf[key]
+
+    ids = [RAWS[1]['id'], RAWS[4]['id'], "unknown"]
+    expected = {RAWS[1]['id']: "TEST-1", RAWS[4]['id']: "TEST-4"}
+    assert cache.storage.keys_for_ids(ids) == expected
+    assert shelf["_id_map"] is True
+    assert cache.storage.keys_for_ids(ids) == expected
+
+
+def test_payload_projection(tmp_path):
+    "Unused parts of users and worklogs are dropped at ingest"
+    user = {
+        "name": "jdoe", "displayName": "John Doe", "timeZone": "Europe/Warsaw",
+        "self": "https://jira/rest/api/2/user?username=jdoe",
+        "avatarUrls": {"48x48": "https://jira/avatar/48", "16x16": "https://jira/avatar/16"},
+    }
+    raw = make_raw("TEST-1", "2020-10-01T10:00:00.000+0000", timespent=60)
+    raw['fields']['assignee'] = user
+    cache = make_cache(tmp_path, "sqlite", [raw], sync_worklogs=True,
+                       payload_projection=True)
+    cache.update()
+
+    stored = cache.get_raw("TEST-1")['fields']
+    assert stored['assignee'] == {"name": "jdoe", "displayName": "John Doe"}
+    assert stored['worklog']['worklogs'][0]['author'] == {"name": "worker"}
+    assert stored['summary'] == raw['fields']['summary']
+    assert cache.projection.bytes_after < cache.projection.bytes_before
+    assert "bytes saved per issue" in cache.projection.report()
+
+
+@pytest.mark.parametrize("backend", ["shelve", "sqlite"])
+@pytest.mark.parametrize("compression", ["zlib", "lzma"])
+def test_compression(tmp_path, backend, compression, monkeypatch):
+    "Compressed issues are transparently decoded, also after reopening"
+    monkeypatch.setattr(Codec, "TRAIN_SAMPLE", 5)
+    cache = make_cache(tmp_path, backend, RAWS, cache_compression=compression)
+    cache.update()
+    assert (cache.storage.codec.zdict is not None) == (compression == "zlib")
+    cache.storage.close()
+
+    cache = make_cache(tmp_path, backend, RAWS, cache_compression=compression)
+    assert cache.get_raw("TEST-2") == RAWS[2]
+    assert dict(cache.storage.items())["TEST-5"] == RAWS[5]
+
+    # Disabling compression keeps old entries readable
+    cache.storage.close()
+    cache = make_cache(tmp_path, backend, RAWS)
+    assert cache.get_raw("TEST-2") == RAWS[2]
+
+
+@pytest.mark.parametrize("backend", ["shelve", "sqlite"])
+def test_compression_sample(tmp_path, backend, monkeypatch):
+    "Dictionary is trained only on enough issues, including the stored ones"
+    monkeypatch.setattr(Codec, "TRAIN_SAMPLE", 15)
+    cache = make_cache(tmp_path, backend, RAWS, cache_compression="zlib")
+    cache.update()
+    assert cache.storage.codec.zdict is None
+    assert cache.storage.get_meta('compression_dict') is None
+
+    cache.storage.prime([dict(raw, key=raw['key'] + "0") for raw in RAWS])
+    assert cache.storage.codec.zdict is not None
+    assert cache.storage.get_meta('compression_dict') is not None
+    # Issues stored before the dictionary remain readable
+    assert cache.get_raw("TEST-2") == RAWS[2]
+
+
+def test_snapshot(tmp_path):
+    "Snapshot is used until the cache changes"
+    cache = make_cache(tmp_path, "sqlite", RAWS, cache_snapshot=True)
+    assert cache.load_snapshot() is None
+    cache.update()
+    generation = cache.get_status()['generation']
+    assert generation > 0
+    issues = cache.load_snapshot()
+    assert sorted(issues, key=lambda raw: raw['key']) == sorted(RAWS, key=lambda raw: raw['key'])
+
+    # Re-reading unchanged issues doesn't invalidate the snapshot
+    cache.update()
+    assert cache.get_status()['generation'] == generation
+    assert cache.load_snapshot() is not None
+
+    with cache.storage.transaction():
+        cache.storage.put("TEST-NEW", make_raw("TEST-NEW", RAWS[0]['fields']['updated']))
+        cache._bump_generation()
+    assert cache.load_snapshot() is None
+
+
+@pytest.mark.parametrize("backend", ["shelve", "sqlite"])
+def test_persisted_extracts(tmp_path, backend):
+    "Search extracts are stored along issues"
+    cache = make_cache(tmp_path, backend, RAWS)
+    cache.update()
+    assert cache.storage.get_meta('extract_version') == EXTRACT_VERSION
+    cache.storage.close()
+
+    # Extracts of a fresh sync are read without decoding the issues
+    cache = make_cache(tmp_path, backend, RAWS)
+    items = cache.storage.items
+    cache.storage.items = None
+    keys, extracts = cache.load_extracts()
+    assert sorted(keys) == sorted(raw['key'] for raw in RAWS)
+    by_key = dict(zip(keys, extracts))
+    assert by_key["TEST-4"] == extract_issue(RAWS[4])
+    cache.storage.items = items
+
+    # Extracts of an older version are recomputed, issues are kept
+    with cache.storage.transaction():
+        cache.storage.put("TEST-4", RAWS[4], "stale")
+        cache.storage.put_meta('extract_version', 0)
+    cache.storage.put = None
+    keys, extracts = cache.load_extracts()
+    assert dict(zip(keys, extracts))["TEST-4"] == extract_issue(RAWS[4])
+    assert cache.storage.get_meta('extract_version') == EXTRACT_VERSION
+
+
+def test_change_events(tmp_path):
+    "Listeners receive extracts of committed changes"
+    raws = [dict(raw) for raw in RAWS]
+    cache = make_cache(tmp_path, "sqlite", raws, commit_interval=4)
+    events = []
+    generations = []
+
+    def listener(changed, generation):
+        events.append(changed)
+        generations.append(generation)
+    cache.subscribe(listener)
+    cache.update()
+    assert sum(len(changed) for changed in events) == len(raws)
+    assert generations == [1, 2, 3]
+    assert events[0]["TEST-0"] == extract_issue(raws[0])
+
+    # Only changed issues are reported
+    events.clear()
+    raws[2] = make_raw("TEST-2", "2020-11-01T10:00:00.000+0000", summary="Changed")
+    cache.update()
+    assert events == [{"TEST-2": extract_issue(raws[2])}]
+
+    cache.unsubscribe(listener)
+    raws[3] = make_raw("TEST-3", "2020-11-02T10:00:00.000+0000", summary="Changed")
+    cache.update()
+    assert len(events) == 1
+
+
+def test_extract_spec_change(tmp_path):
+    "Extracts are recomputed after the extraction spec changes"
+    cache = make_cache(tmp_path, "sqlite", RAWS)
+    cache.update()
+    cache.load_extracts()
+    cache.storage.close()
+
+    spec = {'text': [{'path': 'fields.summary'}], 'fields': [{'path': 'key', 'prefix': 'k='}]}
+    cache = make_cache(tmp_path, "sqlite", RAWS, extract_spec=spec, extract_processes=2)
+    keys, extracts = cache.load_extracts()
+    assert dict(zip(keys, extracts))["TEST-4"] == "Issue number 4 \x1ek=TEST-4"
+    assert cache.storage.get_meta('extract_version') == cache.extract_version
+
+
+def test_query_cache(tmp_path):
+    "Persisted query results are valid until the issues change"
+    cache = make_cache(tmp_path, "sqlite", RAWS)
+    cache.update()
+    generation = cache.get_status()['generation']
+    cache.save_query_cache([("issue", 3, ["TEST-1", "TEST-2"]), ("x", 1, None)],
+                           generation)
+    assert cache.load_query_cache() == [("issue", 3, ["TEST-1", "TEST-2"]), ("x", 1, None)]
+
+    with cache.storage.transaction():
+        cache._bump_generation()
+    assert cache.load_query_cache() == [("issue", 3, None), ("x", 1, None)]
+
+
+def test_raw_cache(tmp_path):
+    "Displayed issues are decoded once and evicted over the budget"
+    cache = make_cache(tmp_path, "sqlite", RAWS)
+    cache.update()
+    assert cache.raw_cache_size == 0
+    raw = cache.get_raw("TEST-1")
+    assert cache.get_raw("TEST-1") is raw
+    assert cache.memory_usage()['raws'] == cache.raw_cache_size > 0
+
+    # Stored issue is decoded again
+    with cache.storage.transaction():
+        cache._put("TEST-1", make_raw("TEST-1", raw['fields']['updated'], "New"))
+    assert cache.get_raw("TEST-1")['fields']['summary'] == "New"
+
+    cache.raw_cache_memory = cache.raw_cache_size * 3
+    for raw in RAWS:
+        cache.get_raw(raw['key'])
+    assert cache.raw_cache_size <= cache.raw_cache_memory
+    assert 1 < len(cache.raw_cache) < len(RAWS)
+    assert list(cache.raw_cache) == [raw['key'] for raw in RAWS[-len(cache.raw_cache):]]
+    assert cache.get_raw("TEST-MISSING") is None
@@ -1,4 +1,19 @@
+from time import time, sleep
+from datetime import datetime
+from array import array
+from functools import partial
+
+import pytest
+
 from fatjira import IncrementalSearch
+from fatjira.incremental_search import Corpus
+from fatjira.search_worker import SearchWorker
+from fatjira.sharded_search import ShardedSearch
+from fatjira.search_index import TrigramIndex
+from fatjira.field_index import FieldIndex, CombinedIndex
+from fatjira.column_index import ColumnIndex
+from fatjira.extract import extract_issue
+from fatjira.ranking import Ranker, RankedResults
 
 DOCS_FIXTURE = [
     # Complicated document to test recursive flattening
@@ -26,6 +41,50 @@ DOCS_FIXTURE = [
 ]
 
 
+# Extracts for comparing search variants
+CORPUS = [
+    "PROJ-%d k=PROJ-%d %s @%s st=%s" % (i, i, summary, user, status)
+    for i, (summary, user, status) in enumerate(
+        (summary, user, status)
+        for summary in ["Fix the Beer cooler", "wool and lasers", "Kittens ARE cute",
+                        "bears are cute", "Zażółć gęślą jaźń", "beetroot soup"]
+        for user in ["alice", "bob", "Carol"]
+        for status in ["OPEN", "OPENED", "INPROGRESS", "DONE"]
+    )
+]
+
+# Query sequences typed in the search
+TYPED = [
+    "b", "be", "bee", "beer", "beer c", "beer co", "Beer", "BEER",
+    "wool a", "wool and l", "cute @al", "cute @alice st=OPEN", "st=OPEN",
+    "gęś", "ŻÓŁ", "soup bee", "PROJ-1", "PROJ-12", "zz", "e",
+]
+
+
+def search_all(inc, queries=TYPED):
+    "Results for each query in sequence"
+    results = []
+    for query in queries:
+        inc.search(query)
+        results.append(list(inc.current_results))
+    return results
+
+
+def reference_results(queries=TYPED):
+    "Results computed by the plain substring scan"
+    results = []
+    for query in queries:
+        terms = IncrementalSearch(CORPUS, extracts=CORPUS)
+        terms.query = query
+        found = [
+            idx for idx, extract in enumerate(CORPUS)
+            if all(term in (extract if term != term.lower() else extract.lower())
+                   for term in terms.get_normalized_query().split())
+        ]
+        results.append(found)
+    return results
+
+
 class TestIncrementalSearch:
 
     def test_document_extraction(self):
@@ -99,3 +158,705 @@ class TestIncrementalSearch:
         assert len(inc.current_results) == 0
         assert "wool and bee" in inc.cache
         assert "wool and beetroot" in inc.cache
+
+    def test_precomputed_extracts(self):
+        "Search can start from already extracted texts"
+        keys = ["doc1", "doc2"]
+        extracts = [
+            IncrementalSearch.recursive_extract_fn(doc)
+            for doc in DOCS_FIXTURE[1:]
+        ]
+        inc = IncrementalSearch(keys, extracts=extracts)
+        inc.search("beer")
+        assert inc.get_results() == ["doc2"]
+
+    def test_trigram_engine(self):
+        "Index engine doesn't alter the results"
+        assert search_all(IncrementalSearch(CORPUS, extracts=CORPUS)) == reference_results()
+        inc = IncrementalSearch(CORPUS, extracts=CORPUS, engine=TrigramIndex)
+        assert search_all(inc) == reference_results()
+
+        index = inc.engine
+        assert index.candidates("be", sensitive=False) is None
+        assert index.candidates("xyz", sensitive=False) == set()
+        assert index.memory_usage() > 0
+
+    def test_search_worker(self):
+        "Background search publishes final results of the newest query"
+        inc = IncrementalSearch(CORPUS, extracts=CORPUS)
+        worker = SearchWorker(inc, partial_size=2)
+        try:
+            assert worker.results == CORPUS
+            for query in TYPED:
+                worker.submit(query)
+            deadline = time() + 5
+            while worker.busy and time() < deadline:
+                sleep(0.01)
+            assert not worker.busy
+            assert worker.poll()
+            assert worker.results_query == TYPED[-1]
+            expected = reference_results(TYPED[-1:])[0]
+            assert worker.results == [CORPUS[idx] for idx in expected]
+        finally:
+            worker.stop()
+
+    def test_search_cancel(self):
+        "Cancelled search leaves no cached results; partial ones are reported"
+        inc = IncrementalSearch(CORPUS, extracts=CORPUS)
+        inc.CANCEL_CHECK = 1
+        assert inc.search("e", cancel=lambda: True) is False
+        assert "e" not in inc.cache
+
+        partial = []
+        assert inc.search("e", on_partial=partial.append, partial_size=3)
+        assert partial == [list(inc.current_results[:3])]
+
+    def test_sharded_search(self):
+        "Search split across processes returns results in the same order"
+        sharded = ShardedSearch(CORPUS, CORPUS, shards=3)
+        try:
+            assert len(sharded.offsets) == 3
+            assert search_all(sharded) == reference_results()
+            assert sharded.get_results(2) == [
+                CORPUS[idx] for idx in sharded.current_results[:2]]
+            assert sharded.search("e", cancel=lambda: True) is False
+            # Stale responses of a cancelled query are skipped
+            assert search_all(sharded, ["wool"]) == reference_results(["wool"])
+        finally:
+            sharded.close()
+
+    def test_term_cache(self):
+        "Known terms are intersected instead of scanned"
+        inc = IncrementalSearch(CORPUS, extracts=CORPUS)
+        assert search_all(inc) == reference_results()
+        assert "beer" in inc.term_cache
+        assert "bee" in inc.term_cache
+        assert isinstance(inc.current_results, array)
+
+        scanned = []
+        scan = inc._scan
+        inc._scan = lambda scope, term, *args: scanned.append(term) or scan(scope, term, *args)
+
+        # Reordering terms and retyping known ones doesn't scan
+        queries = ["soup beer", "beer soup", "cute wool", "wool cute"]
+        assert search_all(inc, queries) == reference_results(queries)
+        assert scanned == []
+
+    def test_term_cache_memory(self):
+        "Term cache is bounded by memory"
+        inc = IncrementalSearch(CORPUS, extracts=CORPUS, term_cache_memory=200)
+        search_all(inc)
+        assert inc.term_cache_size <= 200 or len(inc.term_cache) == 1
+        assert inc.term_cache_size == sum(
+            found.itemsize * len(found) for found in inc.term_cache.values())
+        assert search_all(inc) == reference_results()
+
+    def test_corpus(self):
+        "Columnar corpus matches the plain scan in both sweep and per-document mode"
+        corpus = Corpus(CORPUS)
+        assert len(corpus) == len(CORPUS)
+        assert list(corpus) == CORPUS
+        assert list(corpus.find_all("beer", False)) == [
+            idx for idx, extract in enumerate(CORPUS) if "beer" in extract.lower()
+        ]
+
+        # Lowercasing changing text length keeps the documents aligned
+        extracts = ["İstanbul x", "foo", "ıi bar", "x"]
+        corpus = Corpus(extracts)
+        assert list(corpus.find_all("x", False)) == [0, 3]
+        assert list(corpus.find_all("bar", False)) == [2]
+        assert corpus.contains(3, "x", False)
+
+        # Tails are kept, but not searched
+        extracts = ["a 1 \x1cupd=1", "b\x1cupd=2", "c 2"]
+        corpus = Corpus(extracts)
+        assert list(corpus) == extracts
+        assert list(corpus.find_all("upd", False)) == []
+        assert list(corpus.find_all("2", False)) == [2]
+        assert not corpus.contains(1, "2", True)
+        corpus.extend(["d\x1cupd=4", "e 4"])
+        assert corpus[3] == "d\x1cupd=4"
+        assert list(corpus.find_all("4", False)) == [4]
+
+        inc = IncrementalSearch(CORPUS, extracts=CORPUS)
+        for ratio in (0, 10**6):
+            inc.SWEEP_RATIO = ratio
+            inc.term_cache.clear()
+            inc.cache = {"": inc._all()}
+            assert search_all(inc) == reference_results()
+        usage = inc.memory_usage()
+        assert usage['corpus'] > 0
+        assert usage['term_cache'] == inc.term_cache_size
+
+    @pytest.mark.parametrize("engine", [None, TrigramIndex])
+    def test_update_documents(self, engine):
+        "Live search follows document updates without losing the caches"
+        extracts = dict(zip(range(len(CORPUS)), CORPUS))
+        inc = IncrementalSearch(list(extracts), extracts=list(extracts.values()),
+                                engine=engine)
+        inc.COMPACT_RATIO = 1
+        search_all(inc)
+        inc.search("cute")
+
+        def expected(query):
+            terms = query.split()
+            return sorted(
+                key for key, extract in extracts.items()
+                if all(term in (extract if term != term.lower() else extract.lower())
+                       for term in terms)
+            )
+
+        changes = {
+            0: "PROJ-0 cute beer",
+            1000: "NEW-1000 Cute wool",
+            1001: "NEW-1001 nothing",
+        }
+        extracts.update(changes)
+        del extracts[5]
+        inc.update_documents(changes, removed=[5])
+
+        assert inc.count() == len(extracts)
+        assert sorted(inc.get_results()) == expected("cute")
+        assert "beer" in inc.term_cache
+        scanned = []
+        scan = inc._scan
+        inc._scan = lambda scope, term, *args: scanned.append(term) or scan(scope, term, *args)
+        for query in ["beer", "cute", "cute beer", "wool"]:
+            inc.search(query)
+            assert sorted(inc.get_results()) == expected(query)
+        assert scanned == []
+
+        for query in ["Cute", "nothing", "PROJ-5 "]:
+            inc.search(query)
+            assert sorted(inc.get_results()) == expected(query)
+
+        # Compaction renumbers documents
+        inc.COMPACT_RATIO = 0
+        inc.update_documents(removed=[0])
+        del extracts[0]
+        assert inc.removed == set()
+        assert len(inc.documents) == len(extracts)
+        for query in ["beer", "cute", "wool"]:
+            inc.search(query)
+            assert sorted(inc.get_results()) == expected(query)
+
+    def test_update_alternatives(self):
+        "Cached alternatives looking like negations are patched as text"
+        extracts = ["a -dash", "b plain", "c dash"]
+        inc = IncrementalSearch(list(range(3)), extracts=extracts)
+        inc.search("zzz|-dash")
+        assert "-dash" in inc.term_cache
+        inc.update_documents({3: "d -dash", 4: "e nothing"})
+        extracts += ["d -dash", "e nothing"]
+        for query in ["yyy|-dash", "--dash", "-dash"]:
+            inc.search(query)
+            fresh = IncrementalSearch(list(range(5)), extracts=extracts)
+            fresh.search(query)
+            assert list(inc.current_results) == list(fresh.current_results)
+
+    def test_worker_update_documents(self):
+        "Worker applies updates and searches the current query again"
+        inc = IncrementalSearch(list(range(len(CORPUS))), extracts=CORPUS)
+        worker = SearchWorker(inc)
+        try:
+            worker.submit("lasers")
+            deadline = time() + 5
+            while worker.busy and time() < deadline:
+                sleep(0.01)
+            before = len(worker.results)
+            worker.update_documents({"NEW-1": "more lasers"})
+            while (worker.busy or len(worker.results) == before) and time() < deadline:
+                sleep(0.01)
+            assert worker.results[-1] == "NEW-1"
+            assert worker.total == len(CORPUS) + 1
+        finally:
+            worker.stop()
+
+    def test_worker_publishes_details(self):
+        "Match positions and memory usage are computed by the worker thread"
+        inc = IncrementalSearch(list(range(len(CORPUS))), extracts=CORPUS)
+        worker = SearchWorker(inc, highlight=True, measure=True)
+        try:
+            assert worker.memory['corpus'] > 0
+            worker.submit("beer")
+            deadline = time() + 5
+            while (worker.busy or worker.results_query != "beer") and time() < deadline:
+                sleep(0.01)
+            for doc in worker.results:
+                head = inc.extracts.head(doc)
+                start = head.lower().find("beer")
+                assert worker.positions[doc] == list(range(start, start + 4))
+            assert worker.memory['term_cache'] > 0
+        finally:
+            worker.stop()
+
+
+def make_issue(i, status, assignee=None, labels=(), summary="Summary"):
+    return {
+        "key": "FLD-%d" % i,
+        "fields": {
+            "summary": summary,
+            "description": None,
+            "assignee": {"name": assignee} if assignee else None,
+            "reporter": {"name": "rep"},
+            "status": {"name": status},
+            "issuetype": {"name": "Task"},
+            "project": {"key": "FLD"},
+            "labels": list(labels),
+            "components": [{"name": "Back end"}],
+        }
+    }
+
+
+ISSUES = [
+    make_issue(i, status, assignee, labels, summary)
+    for i, (status, assignee, labels, summary) in enumerate(
+        (status, assignee, labels, summary)
+        for status in ["Open", "Opened", "In Progress", "Done"]
+        for assignee in [None, "alice", "alicia"]
+        for labels in [(), ("ops",), ("ops", "dev")]
+        for summary in ["Fix st=OPEN wording", "Cooler beer"]
+    )
+]
+
+
+class TestFieldFilters:
+
+    def setup_method(self):
+        self.extracts = [extract_issue(issue) for issue in ISSUES]
+        self.inc = IncrementalSearch(list(range(len(ISSUES))), extracts=self.extracts,
+                                     fields=FieldIndex)
+
+    def expected(self, predicate):
+        return [idx for idx, issue in enumerate(ISSUES) if predicate(issue['fields'])]
+
+    def test_exact_filters(self):
+        "Field filters select exact values without scanning"
+        scanned = []
+        scan = self.inc._scan
+        self.inc._scan = lambda scope, term, *args: scanned.append(term) or scan(scope, term, *args)
+
+        self.inc.search("st=OPEN")
+        assert list(self.inc.current_results) == self.expected(
+            lambda f: f['status']['name'] == "Open")
+        self.inc.search("st=open @alice l=dev")
+        assert list(self.inc.current_results) == self.expected(
+            lambda f: f['status']['name'] == "Open" and
+            f['assignee'] and f['assignee']['name'] == "alice" and
+            "dev" in f['labels'])
+        self.inc.search("@none c=Back")
+        assert len(self.inc.current_results) == len(self.expected(lambda f: not f["assignee"]))
+        assert scanned == []
+
+        # Only free text terms are scanned, within the filtered documents
+        self.inc.search("st=DONE beer")
+        assert scanned == ["beer"]
+        assert list(self.inc.current_results) == self.expected(
+            lambda f: f['status']['name'] == "Done" and "beer" in f['summary'])
+
+    def test_incremental_typing(self):
+        "Unknown values select by a prefix until complete"
+        results = {}
+        for query in ["st=O", "st=OP", "st=OPEN", "st=OPENE", "st=OPENED",
+                      "st=OPENED ", "st=OPENED @ali", "st=OPENED @alice"]:
+            self.inc.search(query)
+            results[query] = list(self.inc.current_results)
+        opened = self.expected(lambda f: f['status']['name'] == "Opened")
+        assert results["st=OP"] == self.expected(
+            lambda f: f['status']['name'] in ("Open", "Opened"))
+        assert results["st=OPENE"] == opened
+        assert results["st=OPENED"] == opened
+        assert results["st=OPENED @ali"] == self.expected(
+            lambda f: f['status']['name'] == "Opened" and f['assignee'])
+        assert results["st=OPENED @alice"] == self.expected(
+            lambda f: f['status']['name'] == "Opened" and f['assignee'] and
+            f['assignee']['name'] == "alice")
+
+        inc = IncrementalSearch([], extracts=[], fields=FieldIndex)
+        inc.query = "st=OPENED st=OPEN beer bee"
+        assert inc.get_normalized_query() == "st=OPENED st=OPEN beer"
+
+    def test_partial_results(self):
+        "Partial results of a sweep are limited to the documents matching so far"
+        self.inc.SWEEP_RATIO = 1000
+        self.inc.update_documents(removed=[1])
+        partial = []
+        assert self.inc.search("st=OPEN beer", on_partial=partial.append, partial_size=8)
+        results = list(self.inc.current_results)
+        assert partial and partial[0] == results[:len(partial[0])]
+        assert 1 not in partial[0]
+
+    def test_sharded(self):
+        "Shards resolve complete values by the values of all shards"
+        # Only the second shard has Opened issues and no Open ones
+        issues = sorted(ISSUES, key=lambda issue: issue['fields']['status']['name'] == "Opened")
+        extracts = [extract_issue(issue) for issue in issues]
+        inc = IncrementalSearch(list(range(len(issues))), extracts=extracts,
+                                fields=FieldIndex)
+        sharded = ShardedSearch(list(range(len(issues))), extracts, shards=2,
+                                fields=FieldIndex)
+        try:
+            for query in ["st=OPEN", "st=OPE", "st=OPEN beer", "st=OPENED @alice"]:
+                inc.search(query)
+                sharded.search(query)
+                assert list(sharded.current_results) == list(inc.current_results)
+        finally:
+            sharded.close()
+
+    def test_update_documents(self):
+        "Updated documents are indexed"
+        self.inc.search("st=DONE")
+        issue = make_issue(1000, "Done", summary="Late beer")
+        self.inc.update_documents({0: extract_issue(issue)})
+        assert 0 in self.inc.get_results()
+        self.inc.search("st=DONE beer")
+        assert 0 in self.inc.get_results()
+        self.inc.search("st=OPEN")
+        assert 0 not in self.inc.get_results()
+
+        # Unchanged documents are kept in place
+        removed = set(self.inc.removed)
+        self.inc.update_documents({0: extract_issue(issue), 1: self.extracts[1]})
+        assert self.inc.removed == removed
+
+
+DAY = 24 * 3600
+NOW = datetime(2026, 10, 18, 12, 0).timestamp()
+
+
+def make_dated_issue(i):
+    issue = make_issue(i, "Open", summary="Dated")
+    fields = issue['fields']
+    fields['created'] = datetime.fromtimestamp(NOW - i * DAY).isoformat()
+    fields['updated'] = datetime.fromtimestamp(NOW - i * 3600).isoformat()
+    if i % 3:
+        fields['timespent'] = i * 1800
+    if i % 2:
+        fields['duedate'] = datetime.fromtimestamp(NOW + (i - 20) * DAY).strftime("%Y-%m-%d")
+    return issue
+
+
+DATED = [make_dated_issue(i) for i in range(60)]
+
+
+class TestRangeFilters:
+
+    def setup_method(self):
+        self.extracts = [extract_issue(issue) for issue in DATED]
+        columns = partial(ColumnIndex, now=lambda: NOW)
+        self.inc = IncrementalSearch(list(range(len(DATED))), extracts=self.extracts,
+                                     fields=partial(CombinedIndex,
+                                                    indexes=(FieldIndex, columns)))
+
+    def results(self, query):
+        self.inc.search(query)
+        return list(self.inc.current_results)
+
+    def test_ranges(self):
+        "Ranges are selected from the sorted columns without scanning"
+        scanned = []
+        scan = self.inc._scan
+        self.inc._scan = lambda scope, term, *args: scanned.append(term) or scan(scope, term, *args)
+
+        assert self.results("created<7d") == list(range(7))
+        assert self.results("created>=7d") == list(range(7, 60))
+        assert self.results("created>2026-10-10") == list(range(9))
+        assert self.results("upd>yesterday") == list(range(36))
+        assert self.results("spent>4h") == [i for i in range(60) if i % 3 and i > 8]
+        assert self.results("spent<=1d") == [i for i in range(1, 17) if i % 3]
+        assert self.results("spent>1h30m") == [i for i in range(60) if i % 3 and i > 3]
+        assert self.results("due<today") == [i for i in range(1, 20, 2)]
+        assert self.results("due<today created<7d") == [1, 3, 5]
+        assert self.results("due<today|spent>20h") == [
+            i for i in range(60) if (i % 2 and i < 20) or (i % 3 and i > 40)]
+        assert self.results("-created<7d spent<2h") == []
+        assert scanned == []
+
+    def test_columns_not_searched(self):
+        "Numbers match the issue text, not the column values"
+        assert self.results("k=FLD-2") == [2]
+        assert self.results("FLD-2") == [2] + list(range(20, 30))
+        assert self.results("upd") == []
+        assert self.results("%d" % NOW) == []
+
+    def test_typing(self):
+        "Incomplete values are ignored and partial values never reused"
+        assert self.results("created<") == list(range(60))
+        assert self.results("created<2") == list(range(60))
+        assert self.results("created<2d") == [0, 1]
+        assert self.results("created<20d") == list(range(20))
+        assert self.results("created<20d ") == list(range(20))
+
+    def test_matches(self):
+        "Added documents are matched one by one"
+        self.inc.search("created<7d")
+        self.inc.update_documents({100: extract_issue(make_dated_issue(2))})
+        self.inc.search("created<7d spent")
+        self.inc.search("created<7d")
+        assert 100 in self.inc.get_results()
+        columns = ColumnIndex([], now=lambda: NOW)
+        extract = extract_issue(make_dated_issue(5))
+        assert columns.matches(extract, *columns.parse_term("spent>2h"))
+        assert not columns.matches(extract, *columns.parse_term("spent>3h"))
+        assert not columns.matches(extract_issue(make_issue(0, "Open")),
+                                   *columns.parse_term("spent<3h"))
+
+    def test_history(self):
+        "Results depending on the current time are not persisted"
+        search_all(self.inc, ["created<7d", "", "st=OPEN", ""])
+        exported = dict((query, documents) for query, _, documents in self.inc.export_history())
+        assert exported["created<7d"] is None
+        assert exported["st=OPEN"] == list(range(60))
+
+
+def reference_match(extract, term):
+    "Plain evaluation of a single query term"
+    negative = term.startswith("-")
+    alternatives = [alt for alt in term.lstrip("-").split("|") if alt]
+    if not alternatives:
+        return True
+    matched = any(
+        alt in (extract if alt != alt.lower() else extract.lower())
+        for alt in alternatives
+    )
+    return matched != negative
+
+
+class TestSetAlgebra:
+
+    TYPED = [
+        "cute", "cute -", "cute -b", "cute -be", "cute -bea", "cute -bears",
+        "cute -bears @al", "w", "wo", "wool", "wool|", "wool|b", "wool|be",
+        "wool|beer", "wool|beer -", "wool|beer -st=O", "wool|beer -st=OPEN",
+        "-DONE", "-DONE -OPEN", "-DONE|OPEN", "-DONE|OPEN bear",
+        "st=OPEN|st=DONE", "b|w -c", "b|w -c|z",
+    ]
+
+    def reference(self, queries):
+        results = []
+        for query in queries:
+            results.append([
+                idx for idx, extract in enumerate(CORPUS)
+                if all(reference_match(extract, term) for term in query.split())
+            ])
+        return results
+
+    def test_typed(self):
+        "Negative and alternative terms while typing"
+        inc = IncrementalSearch(CORPUS, extracts=CORPUS)
+        assert search_all(inc, self.TYPED) == self.reference(self.TYPED)
+        # Again with the warm term cache and in reverse
+        assert search_all(inc, self.TYPED) == self.reference(self.TYPED)
+        typed = self.TYPED[::-1]
+        assert search_all(inc, typed) == self.reference(typed)
+
+    def test_no_rescan(self):
+        "Known terms are combined with set algebra"
+        inc = IncrementalSearch(CORPUS, extracts=CORPUS)
+        search_all(inc, ["beer", "wool", "cute"])
+        scanned = []
+        scan = inc._scan
+        inc._scan = lambda scope, term, *args: scanned.append(term) or scan(scope, term, *args)
+        queries = ["cute -wool", "beer|wool", "-beer|wool cute", "-cute"]
+        assert search_all(inc, queries) == self.reference(queries)
+        assert scanned == []
+
+    def test_empty_alternative(self):
+        "Leading or trailing | is ignored, also without the typed prefixes"
+        queries = ["wool|", "|be", "cute be|", "-|wool"]
+        for query in queries:
+            inc = IncrementalSearch(CORPUS, extracts=CORPUS)
+            assert search_all(inc, [query]) == self.reference([query])
+            assert not any("|" in term for term in inc.term_cache)
+
+        extracts = [extract_issue(issue) for issue in ISSUES]
+        inc = IncrementalSearch(list(range(len(ISSUES))), extracts=extracts,
+                                fields=FieldIndex)
+        inc.search("st=OPEN|")
+        assert list(inc.current_results) == [
+            idx for idx, issue in enumerate(ISSUES)
+            if issue['fields']['status']['name'] == "Open"
+        ]
+
+    def test_fuzzy_alternative(self):
+        "Alternative starting with an ignored ~ doesn't narrow the term"
+        typed = ["w", "wo", "woo", "woo|", "woo|~", "woo|~b", "woo|~be"]
+        expected = []
+        for query in typed:
+            inc = IncrementalSearch(CORPUS, extracts=CORPUS)
+            expected.append(search_all(inc, [query])[0])
+        inc = IncrementalSearch(CORPUS, extracts=CORPUS)
+        assert search_all(inc, typed) == expected
+        assert len(expected[-1]) > len(expected[2])
+
+    def test_normalization(self):
+        inc = IncrementalSearch([], extracts=[])
+        inc.query = "bee -be -bee -be be|x bee|x be"
+        assert inc.get_normalized_query() == "bee -be -bee be|x bee|x"
+
+    def test_negative_field_filter(self):
+        extracts = [extract_issue(issue) for issue in ISSUES]
+        inc = IncrementalSearch(list(range(len(ISSUES))), extracts=extracts,
+                                fields=FieldIndex)
+        inc.search("-st=DONE beer")
+        assert list(inc.current_results) == [
+            idx for idx, issue in enumerate(ISSUES)
+            if issue['fields']['status']['name'] != "Done" and
+            "beer" in issue['fields']['summary'].lower()
+        ]
+        inc.search("st=DONE|st=OPEN")
+        assert list(inc.current_results) == [
+            idx for idx, issue in enumerate(ISSUES)
+            if issue['fields']['status']['name'] in ("Done", "Open")
+        ]
+
+
+class TestRanking:
+
+    def setup_method(self):
+        self.issues = [
+            make_issue(0, "Open", summary="Unrelated"),
+            make_issue(1, "Open", summary="beer in the summary"),
+            make_issue(2, "Open", assignee="me", summary="beer assigned"),
+            make_issue(3, "Open", summary="Nothing"),
+            make_issue(4, "Open", summary="Old beer"),
+        ]
+        self.issues[0]['fields']['description'] = "beer in the description"
+        self.issues[3]['key'] = "BEER-3"
+        for i, issue in enumerate(self.issues):
+            issue['fields']['updated'] = "2020-10-0%dT10:00:00.000+0000" % (i + 1)
+        self.issues[4]['fields']['updated'] = "2010-10-01T10:00:00.000+0000"
+        extracts = [extract_issue(issue) for issue in self.issues]
+        self.inc = IncrementalSearch([issue['key'] for issue in self.issues],
+                                     extracts=extracts, fields=FieldIndex,
+                                     ranker=partial(Ranker, me="me"))
+
+    def test_order(self):
+        "Key, summary, assignment and recency order the results"
+        self.inc.search("beer")
+        assert self.inc.get_results() == ["BEER-3", "FLD-2", "FLD-1", "FLD-4", "FLD-0"]
+        assert self.inc.get_results(2) == ["BEER-3", "FLD-2"]
+        # Filters don't affect the location score
+        self.inc.search("beer -st=DONE")
+        assert self.inc.get_results(3) == ["BEER-3", "FLD-2", "FLD-1"]
+
+    def test_lazy_top(self):
+        "Only the requested top is selected"
+        ranked = RankedResults(array('I', range(1000)), key=lambda idx: -idx)
+        assert ranked.top(3) == [999, 998, 997]
+        assert len(ranked._top) == 3
+        assert ranked.top(5) == [999, 998, 997, 996, 995]
+        assert len(ranked._top) == 6
+        assert ranked.top(2000) == list(range(999, -1, -1))
+
+    def test_worker_limit(self):
+        "Worker publishes only the top results, more on request"
+        worker = SearchWorker(self.inc, limit=2)
+        try:
+            worker.submit("beer")
+            deadline = time() + 5
+            while worker.busy and time() < deadline:
+                sleep(0.01)
+            assert worker.results == ["BEER-3", "FLD-2"]
+            assert worker.found == 5
+            worker.more(4)
+            while (worker.busy or len(worker.results) < 4) and time() < deadline:
+                sleep(0.01)
+            assert worker.results == ["BEER-3", "FLD-2", "FLD-1", "FLD-4"]
+        finally:
+            worker.stop()
+
+
+def is_subsequence(term, text):
+    chars = iter(text)
+    return all(char in chars for char in term)
+
+
+class TestFuzzy:
+
+    def test_subsequence(self):
+        "Fuzzy terms match characters in order, plain results are not reused"
+        inc = IncrementalSearch(CORPUS, extracts=CORPUS)
+        typed = ["b", "bc", "~b", "~bc", "~bco", "~bcol", "~bcol -~w", "~Bcol", "~frbe"]
+        results = search_all(inc, typed)
+        for query, found in zip(typed, results):
+            assert found == [
+                idx for idx, extract in enumerate(CORPUS)
+                if all(reference_match(extract, term) if not term.lstrip("-").startswith("~")
+                       else term.startswith("-") != is_subsequence(
+                           term.lstrip("-~"),
+                           extract if term != term.lower() else extract.lower())
+                       for term in query.split())
+            ], query
+
+    def test_head_only(self):
+        "Fuzzy terms match only the key and summary"
+        issues = [
+            make_issue(0, "Open", summary="beer cooler"),
+            make_issue(1, "Open", summary="nothing"),
+        ]
+        issues[1]['fields']['description'] = "beer cooler"
+        extracts = [extract_issue(issue) for issue in issues]
+        inc = IncrementalSearch(["FLD-0", "FLD-1"], extracts=extracts)
+        inc.search("~bcool")
+        assert inc.get_results() == ["FLD-0"]
+        inc.search("cooler")
+        assert inc.get_results() == ["FLD-0", "FLD-1"]
+        # Sweep and per-document checks agree
+        inc.SWEEP_RATIO = 0
+        inc.term_cache.clear()
+        inc.search("~bcoo")
+        assert inc.get_results() == ["FLD-0"]
+
+    def test_match_positions(self):
+        issue = make_issue(0, "Open", summary="Fix the beer cooler")
+        inc = IncrementalSearch(["FLD-0"], extracts=[extract_issue(issue)])
+        inc.search("~bcr fix")
+        head, positions = inc.match_positions("FLD-0")
+        assert head == "FLD-0 Fix the beer cooler "
+        assert [head[pos] for pos in positions] == list("Fixbcr")
+        # Shortest window
+        assert positions[3:] == [head.index("beer"), head.index("cooler"),
+                                 head.index("cooler") + 5]
+
+
+class TestHistory:
+
+    def test_settled_queries(self):
+        "Only queries not extended by the next one are remembered"
+        inc = IncrementalSearch(CORPUS, extracts=CORPUS)
+        search_all(inc, ["b", "be", "beer", "w", "wool", "", "beer"])
+        assert {query: entry[0] for query, entry in inc.history.items()} == {
+            "beer": 1, "wool": 1,
+        }
+        exported = inc.export_history()
+        assert exported[0][:2] == ("beer", 2)
+        assert exported[0][2] == [CORPUS[idx] for idx in reference_results(["beer"])[0]]
+
+    def test_restore(self):
+        "Restored queries need no scan"
+        inc = IncrementalSearch(CORPUS, extracts=CORPUS)
+        search_all(inc, ["beer", "cute @al", "x"])
+        exported = inc.export_history()
+
+        inc = IncrementalSearch(CORPUS, extracts=CORPUS)
+        inc.import_history(exported)
+        scanned = []
+        scan = inc._scan
+        inc._scan = lambda scope, term, *args: scanned.append(term) or scan(scope, term, *args)
+        queries = ["beer", "cute @al"]
+        assert search_all(inc, queries) == reference_results(queries)
+        assert scanned == []
+
+        # Stale results are searched again, the counts are kept
+        inc = IncrementalSearch(CORPUS, extracts=CORPUS)
+        inc.import_history([(query, count, None) for query, count, _ in exported])
+        assert search_all(inc, queries) == reference_results(queries)
+        assert inc.history["beer"][0] == 2
+
+    def test_update_patches_history(self):
+        inc = IncrementalSearch(list(range(len(CORPUS))), extracts=CORPUS)
+        search_all(inc, ["beer", "wool"])
+        inc.update_documents({"NEW": "more beer"})
+        inc.search("beer")
+        assert inc.get_results()[-1] == "NEW"
@@ -0,0 +1,111 @@
+from time import time, sleep
+
+from fatjira.search_service import SearchService
+from fatjira.test.test_issue_cache import make_cache, make_raw, RAWS
+
+
+def make_service(cache, **config):
+    jira = cache.jira
+    jira.cache = cache
+    jira.cached_extracts = cache.load_extracts
+    return SearchService(jira, config)
+
+
+def search(worker, query):
+    "Search synchronously"
+    worker.submit(query)
+    deadline = time() + 5
+    while worker.busy or worker.results_query != query:
+        assert time() < deadline
+        sleep(0.01)
+    return sorted(worker.results)
+
+
+def test_shared_search(tmp_path):
+    "Search is loaded once in background and reused"
+    cache = make_cache(tmp_path, "sqlite", RAWS)
+    cache.update()
+    service = make_service(cache)
+    service.start()
+    worker = service.acquire()
+    assert search(worker, "number k=TEST-3") == ["TEST-3"]
+    assert service.acquire() is worker
+    assert service.memory_usage()['corpus'] > 0
+    service.close()
+    assert service.worker is None
+    assert cache.load_query_cache()[0][:2] == ("number k=TEST-3", 1)
+
+
+def test_missed_changes(tmp_path):
+    "Changes of another process committed between local syncs are refreshed"
+    raws = list(RAWS)
+    cache = make_cache(tmp_path, "sqlite", raws)
+    cache.update()
+    service = make_service(cache)
+    worker = service.acquire()
+
+    other = make_cache(tmp_path, "sqlite", [])
+    with other.storage.transaction():
+        other._put("TEST-11", make_raw("TEST-11", "2020-11-02T10:00:00.000+0000",
+                                       summary="Issue number 11"))
+        other._bump_generation()
+    raws.append(make_raw("TEST-10", "2020-11-03T10:00:00.000+0000",
+                         summary="Issue number 10"))
+    cache.update()
+    assert search(worker, "k=TEST-10") == ["TEST-10"]
+    assert service.generation != cache.get_status()['generation']
+
+    assert service.acquire() is worker
+    assert search(worker, "k=TEST-11") == ["TEST-11"]
+    assert service.generation == cache.get_status()['generation']
+    service.close()
+
+
+def test_stale_query_cache(tmp_path):
+    "Results not reflecting changes of another process aren't reused"
+    cache = make_cache(tmp_path, "sqlite", RAWS)
+    cache.update()
+    service = make_service(cache)
+    assert search(service.acquire(), "number") == sorted(raw['key'] for raw in RAWS)
+
+    other = make_cache(tmp_path, "sqlite", [])
+    with other.storage.transaction():
+        other._put("TEST-11", make_raw("TEST-11", "2020-11-02T10:00:00.000+0000",
+                                       summary="Issue number 11"))
+        other._bump_generation()
+    service.close()
+    assert cache.load_query_cache() == [("number", 1, None)]
+
+    service = make_service(cache)
+    assert "TEST-11" in search(service.acquire(), "number")
+    service.close()
+
+
+def test_refresh(tmp_path):
+    "Changes are applied by the change events or noticed by the generation"
+    cache = make_cache(tmp_path, "sqlite", RAWS)
+    cache.update()
+    service = make_service(cache)
+    worker = service.acquire()
+    assert search(worker, "number") == sorted(raw['key'] for raw in RAWS)
+
+    # Synced by this process
+    cache.jira.link.raws.append(make_raw("TEST-10", "2020-11-01T10:00:00.000+0000",
+                                         summary="Issue number 10"))
+    cache.update()
+    assert search(worker, "k=TEST-10") == ["TEST-10"]
+
+    # Stored by another process
+    other = make_cache(tmp_path, "sqlite", [])
+    with other.storage.transaction():
+        other._put("TEST-11", make_raw("TEST-11", "2020-11-02T10:00:00.000+0000",
+                                       summary="Issue number 11"))
+        other._put("TEST-1", make_raw("TEST-1", "2020-11-02T10:00:00.000+0000",
+                                      summary="Renamed"))
+        other._bump_generation()
+    assert search(worker, "k=TEST-11") == []
+    assert service.acquire() is worker
+    assert search(worker, "k=TEST-11") == ["TEST-11"]
+    assert search(worker, "renamed") == ["TEST-1"]
+    assert worker.total == 12
+    service.close()
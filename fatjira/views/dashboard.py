@@ -35,6 +35,7 @@ class DashboardView(CommonView):
         # TODO: Parallel
         self.update_in_progress = True
         self.app.display.redraw()
-        self.app.issue_cache.update()
+        # Stored issues are added to the shared search by the change events
+        self.app.jira.cache.update()
         self.update_in_progress = False
-        self.app.issue_cache.update()
+        self.app.display.redraw()
@@ -1,27 +1,11 @@
 import _curses
 
 from yacui import View
-from fatjira import IncrementalSearch
+from fatjira.column_index import TERM_RE as RANGE_RE
+from fatjira.extract import FIELD_PREFIXES
 from fatjira.views import IssueView
 
 
-def extract_issue(issue):
-    "Experimental issue extractor"
-    f = issue['fields']
-    parts = [
-        issue['key'],
-        "k=" + issue['key'],
-        f['summary'] or "",
-        f['description'] or "",
-        "@" + f['assignee']['name'] if f['assignee'] else "none",
-        "rep=" + f['reporter']['name'] if f['reporter'] else "none",
-        "st=" + f['status']['name'].upper().replace(" ", ""),
-        "t=" + f['issuetype']['name'],
-        # Components?
-    ]
-    return " ".join(parts)
-
-
 class SearchView(View):
     """
     Main application view
@@ -33,32 +17,92 @@ class SearchView(View):
         # Index is not "sticky" when selection changes.
         self.selected_idx = 0
         self.query = ""
+        # Match free text terms as subsequences (fzf-like)
+        self.fuzzy = False
+        # Keys of matching issues
         self.results = []
-
-        # TEMP
-        with self.app.debug.time("Load all issues"):
-            self.all_issues = self.app.jira.all_cached_issues()
-        with self.app.debug.time("Initiate search"):
-            self.search = IncrementalSearch(self.all_issues, extract_issue)
+        # {key: match positions} of the results
+        self.positions = {}
+        # Search is shared by all search views and held by the app - views
+        # keep only their query and the displayed keys.
+        self.service = self.app.jira.search
+        self.worker = None
+
+    def _acquire(self):
+        "Attach to the shared search, unless it's still loading in background"
+        loaded = self.service.worker is not None
+        with self.app.debug.time("Acquire search"):
+            self.worker = self.service.acquire(wait=False)
+        if self.worker is not None and not loaded:
+            self.app.debug.log("Search loaded in {:.2f}".format(self.service.took))
+            self.log_memory()
+
+    def log_memory(self):
+        "Show the memory usage breakdown in the debug window"
+        usage = self.service.memory_usage()
+        total = sum(usage.values())
+        parts = " ".join("{}={:.1f}".format(name, size / 2**20)
+                         for name, size in usage.items())
+        msg = "Memory {:.1f}MB: {}".format(total / 2**20, parts)
+        budget = self.app.jira.cache.memory_budget
+        if budget and total > budget * 2**20:
+            msg += " - over the {}MB budget".format(budget)
+        self.app.debug.log(msg)
+
+    def _fuzzy_query(self):
+        "Turn the free text terms of the query into fuzzy ones"
+        terms = []
+        for term in self.query.split():
+            negative = "-" if term.startswith("-") else ""
+            alternatives = [
+                alternative if (alternative.startswith("~") or not alternative or
+                                alternative.startswith(tuple(FIELD_PREFIXES)) or
+                                RANGE_RE.match(alternative))
+                else "~" + alternative
+                for alternative in term[len(negative):].split("|")
+            ]
+            terms.append(negative + "|".join(alternatives))
+        return " ".join(terms)
 
     def _update_search_state(self):
-        self.search.search(self.query)
-        self.results = self.search.get_results()
+        self.worker.submit(self._fuzzy_query() if self.fuzzy else self.query)
+        self.results = self.worker.results
+        self.positions = self.worker.positions
         if self.selected_idx > len(self.results):
             self.selected_idx = len(self.results)
-        self.app.debug.log("cached queries:" + repr(list(self.search.cache.keys())))
+
+    def tick(self):
+        "Display results published by the search worker"
+        if self.worker is None:
+            if not self.service.is_loading():
+                self.app.display.redraw()
+        elif self.worker.poll():
+            self.app.display.redraw()
 
     def redraw(self, wnd: _curses.window):
         "Refresh the view display"
         lines, cols = wnd.getmaxyx()
         wnd.erase()
-        msg = "Incremental search: " + self.query
+        msg = ("Fuzzy" if self.fuzzy else "Incremental") + " search: " + self.query
         wnd.addstr(0, 0, msg)
         cursor_position = len(msg)
 
+        if self.worker is None:
+            self._acquire()
+        if self.worker is None:
+            msg = "loading issues…"
+            wnd.addstr(0, cols - len(msg), msg)
+            wnd.move(0, cursor_position)
+            return
+
+        self.worker.partial_size = lines
+        # Screen and a scroll buffer; more is requested when scrolling.
+        self.worker.more(2 * lines)
         self._update_search_state()
 
-        msg = "{}/{}".format(len(self.results), len(self.all_issues))
+        msg = "{}/{}".format(self.worker.found, self.worker.total)
+        if self.worker.busy:
+            msg = "searching… " + msg
         wnd.addstr(0, cols - len(msg), msg)
 
         if self.selected_idx >= len(self.results):
@@ -66,13 +110,16 @@ class SearchView(View):
 
         line = 1
         max_summary = cols - 10 - 5
-        for i, result in enumerate(self.results):
+        for i, key in enumerate(self.results):
+            result = self.app.jira.cache.get_raw(key)
             if i == self.selected_idx:
                 th_key = self.app.theme.ISSUE_KEY_SELECTED
                 th_summary = self.app.theme.ISSUE_SUMMARY_SELECTED
+                th_match = self.app.theme.MATCH_SELECTED
             else:
                 th_key = self.app.theme.ISSUE_KEY
                 th_summary = self.app.theme.ISSUE_SUMMARY
+                th_match = self.app.theme.MATCH
 
             # TODO: Unified table generator
             j = result['fields']
@@ -83,21 +130,36 @@ class SearchView(View):
             msg = f"{result['key']:10s} {summary}"
             wnd.addstr(line, 0, "{:15}".format(result['key']), th_key)
             wnd.addstr(line, 15, summary[:cols - 15 - 1], th_summary)
+            self._highlight(wnd, line, key, min(max_summary, cols - 15 - 1), th_match)
             line += 1
             if line == lines:
                 break
 
         wnd.move(0, cursor_position)
 
+    def _highlight(self, wnd, line, key, max_summary, attr):
+        "Highlight the matched characters of the key and summary"
+        for pos in self.positions.get(key, ()):
+            if pos < len(key):
+                wnd.chgat(line, pos, 1, attr)
+            elif pos - len(key) - 1 < max_summary:
+                wnd.chgat(line, 15 + pos - len(key) - 1, 1, attr)
+
     def on_enter(self):
+        # Changes of the cache are applied when returning to the search
+        self.worker = None
         self.app.bindings.push()
         self.app.bindings.register("M-q", "Back", self.app.display.back)
         self.app.bindings.register("RET", "Select", self.action_select)
         self.app.bindings.register(["C-n", "DOWN"], "Next", self.action_next)
         self.app.bindings.register(["C-p", "UP"], "Previous", self.action_prev)
+        self.app.bindings.register("C-f", "Fuzzy", self.action_fuzzy)
+        self.app.bindings.register("M-m", "Memory usage", self.log_memory)
         self.app.bindings.add_hint("Type to search incrementally")
         self.app.bindings.add_hint("@assignee, rep=reporter, st=status")
-        self.app.bindings.add_hint("k=key t=type")
+        self.app.bindings.add_hint("k=key t=type p=project l=label c=component")
+        self.app.bindings.add_hint("upd>2026-09-01 created<7d spent>4h due<today")
+        self.app.bindings.add_hint("-term excludes, a|b matches any, ~term fuzzy")
         msg = "You are " + ("online" if self.app.jira.is_connected() else "offline")
         self.app.bindings.add_hint(msg)
 
@@ -114,17 +176,22 @@ class SearchView(View):
             return
 
         try:
-            result = self.results[self.selected_idx]
+            key = self.results[self.selected_idx]
         except IndexError:
             self.selected_idx = 0
             self.app.display.redraw()
             return
-        key = result['key']
         view = IssueView(self.app, key)
         self.app.display.navigate(view)
 
+    def action_fuzzy(self):
+        self.fuzzy = not self.fuzzy
+        self.app.display.redraw()
+
     def action_next(self):
         self.selected_idx += 1
+        if self.worker is not None and self.selected_idx >= len(self.results) - 1:
+            self.worker.more(2 * len(self.results))
         self.app.display.redraw()
 
     def action_prev(self):
@@ -12,6 +12,10 @@ class Console:
     Curses facade.
     """
 
+    # Period of idle ticks (in tenths of a second) - also the latency of
+    # displaying results of a background work.
+    TICK = 1
+
     def __init__(self, debug=False):
         """
         Args:
@@ -34,7 +38,7 @@ class Console:
         self.stdscr = curses.initscr()
         curses.noecho()
         curses.cbreak()
-        curses.halfdelay(5)
+        curses.halfdelay(self.TICK)
         curses.start_color()
         curses.use_default_colors()
         assert curses.has_colors()
@@ -158,5 +162,5 @@ class Console:
         self.wnd_status.erase()
         self.wnd_status.refresh()
         curses.curs_set(self.cursor_visible)
-        curses.halfdelay(5)
+        curses.halfdelay(self.TICK)
         return status